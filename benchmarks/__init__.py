@@ -0,0 +1,5 @@
+"""Benchmarks of the blog endpoints on synthetic data.
+
+Seed a database with ``python -m benchmarks.seed``, then measure it with
+``python -m benchmarks.run``. See the README for the options.
+"""
@@ -0,0 +1,311 @@
+"""Measure the latency and throughput of the blog endpoints.
+
+    python -m benchmarks.run bench/flaskr.sqlite --threads 4 \\
+        --output results.json --compare baseline.json
+
+Requests go through the app in this process, from one test client per
+thread, so the numbers are those of the app and the database without a
+web server in front. Anonymous visitors read pages and feeds, logged in
+users like and comment.
+
+With ``--check-queries`` the statements each request runs on SQLite are
+counted too, and more than ``QUERY_BUDGETS`` allows fails the run.
+"""
+import argparse
+import ast
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import json
+import math
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+
+from flaskr.db import get_backend, get_db
+from benchmarks.seed import PASSWORD, WORDS, make_app
+
+# most statements a request to each endpoint may run
+QUERY_BUDGETS = {
+    'index': 2,
+    'tag': 2,
+    'search': 2,
+    'read': 3,
+    'like': 3,
+    'comment': 1,
+    'rss': 1,
+}
+LOGGED_IN = {'like', 'comment'}
+COUNTED = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE'}
+
+
+def make_requests(app):
+    """Return a function per endpoint that picks a random request to it."""
+    with app.app_context():
+        db = get_db()
+        last_post = db.execute('SELECT MAX(id) FROM post').fetchone()[0]
+        tags = [row[0] for row in db.execute(
+            'SELECT name FROM tag WHERE post_count > 0'
+        )]
+    if not last_post or not tags:
+        raise SystemExit('Seed the database first, see benchmarks.seed.')
+
+    def post(rng):
+        return rng.randint(1, last_post)
+
+    return {
+        'index': lambda rng: ('GET', '/', None),
+        'tag': lambda rng: ('GET', f'/tag/{rng.choice(tags)}', None),
+        'search': lambda rng: ('GET', f'/?search={rng.choice(WORDS)}', None),
+        'read': lambda rng: ('GET', f'/{post(rng)}', None),
+        'like': lambda rng: ('POST', f'/{post(rng)}/like', {}),
+        'comment': lambda rng: ('POST', f'/{post(rng)}/comment', {
+            'body': ' '.join(rng.choices(WORDS, k=10)),
+        }),
+        'rss': lambda rng: ('GET', '/rss.xml', None),
+    }
+
+
+class QueryCounter:
+    """Count the statements each thread runs on SQLite connections."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+    def reset(self):
+        self._local.count = 0
+        self._local.last = None
+
+    def trace(self, statement):
+        # each statement a trigger runs is traced as the statement that
+        # fired the trigger again, so repeats in a row are counted once
+        if statement == getattr(self._local, 'last', None):
+            return
+        self._local.last = statement
+        words = statement.split(None, 1)
+        if words and words[0].upper() in COUNTED:
+            self._local.count = self.count + 1
+
+    def install(self, app):
+        with app.app_context():
+            backend = get_backend()
+        if backend.name != 'sqlite':
+            raise SystemExit('Queries can only be counted on SQLite.')
+        acquire = backend.acquire
+
+        def traced_acquire(read_only=False):
+            db = acquire(read_only)
+            db.set_trace_callback(self.trace)
+            return db
+
+        backend.acquire = traced_acquire
+
+
+def make_client(app, user):
+    client = app.test_client()
+    if user is not None:
+        response = client.post('/auth/login', data={
+            'username': f'user{user}', 'password': PASSWORD,
+        })
+        if response.status_code != 302:
+            raise SystemExit(f'Could not log in as user{user}.')
+    return client
+
+
+def send(client, method, path, data):
+    response = client.open(path, method=method, data=data)
+    if response.status_code >= 400:
+        raise RuntimeError(f'{method} {path}: {response.status}')
+
+
+def percentile(quantiles, n):
+    return quantiles[n - 1] * 1000
+
+
+def bench(app, name, make_request, requests, threads, warmup, counter=None,
+          seed=0):
+    """Send *requests* requests to an endpoint from *threads* clients.
+
+    Returns throughput in requests per second and latencies in
+    milliseconds, and the most statements a request ran if *counter*.
+    """
+    clients = [
+        make_client(app, n + 1 if name in LOGGED_IN else None)
+        for n in range(threads)
+    ]
+    per_client = math.ceil(requests / threads)
+    latencies = []
+    queries = []
+    lock = threading.Lock()
+
+    def work(n):
+        rng = random.Random(f'{seed}:{name}:{n}')
+        client = clients[n]
+        for _ in range(warmup):
+            send(client, *make_request(rng))
+        timings = []
+        counts = []
+        barrier.wait()
+        for _ in range(per_client):
+            request = make_request(rng)
+            if counter is not None:
+                counter.reset()
+            start = time.perf_counter()
+            send(client, *request)
+            timings.append(time.perf_counter() - start)
+            if counter is not None:
+                counts.append(counter.count)
+        with lock:
+            latencies.extend(timings)
+            queries.extend(counts)
+
+    barrier = threading.Barrier(threads + 1)
+    with ThreadPoolExecutor(threads) as executor:
+        futures = [executor.submit(work, n) for n in range(threads)]
+        barrier.wait()
+        start = time.perf_counter()
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / elapsed,
+        'mean': statistics.fmean(latencies) * 1000,
+        'p50': percentile(quantiles, 50),
+        'p90': percentile(quantiles, 90),
+        'p99': percentile(quantiles, 99),
+        'max': max(latencies) * 1000,
+        'queries': max(queries) if queries else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of *results* against *baseline*."""
+    regressions = []
+    for name, result in results.items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        for key in ('p50', 'p99'):
+            if result[key] > old[key] * (1 + tolerance):
+                regressions.append(
+                    f'{name}: {key} {old[key]:.2f} -> {result[key]:.2f} ms'
+                )
+        if None not in (result['queries'], old['queries']) \
+                and result['queries'] > old['queries']:
+            regressions.append(
+                f"{name}: queries {old['queries']} -> {result['queries']}"
+            )
+    return regressions
+
+
+def check_queries(results):
+    return [
+        f"{name}: {result['queries']} queries, "
+        f'at most {QUERY_BUDGETS[name]} expected'
+        for name, result in results.items()
+        if result['queries'] is not None
+        and result['queries'] > QUERY_BUDGETS[name]
+    ]
+
+
+def print_results(results, file=sys.stdout):
+    print(
+        f"{'endpoint':<10}{'req/s':>9}{'mean':>9}{'p50':>9}{'p90':>9}"
+        f"{'p99':>9}{'max':>9}{'queries':>9}",
+        file=file
+    )
+    for name, result in results.items():
+        queries = result['queries']
+        print(
+            f'{name:<10}' + f"{result['throughput']:>9.1f}" + ''.join(
+                f'{result[key]:>9.2f}'
+                for key in ('mean', 'p50', 'p90', 'p99', 'max')
+            ) + f"{'-' if queries is None else queries:>9}",
+            file=file
+        )
+
+
+def parse_setting(setting):
+    key, _, value = setting.partition('=')
+    try:
+        return key, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return key, value
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('database', help='a database made by benchmarks.seed')
+    parser.add_argument('-e', '--endpoint', action='append',
+                        choices=QUERY_BUDGETS, dest='endpoints',
+                        help='measure only this endpoint; can be repeated')
+    parser.add_argument('-n', '--requests', type=int, default=500,
+                        help='requests per endpoint')
+    parser.add_argument('-t', '--threads', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='unmeasured requests per thread first')
+    parser.add_argument('-c', '--config', action='append', default=[],
+                        type=parse_setting, metavar='KEY=VALUE',
+                        help='app setting, like PAGE_CACHE=memory')
+    parser.add_argument('--check-queries', action='store_true',
+                        help='count statements and check QUERY_BUDGETS')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown that counts as a regression')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(args)
+
+    config = dict(args.config)
+    app = make_app(args.database, config)
+    counter = None
+    if args.check_queries:
+        counter = QueryCounter()
+        counter.install(app)
+    requests = make_requests(app)
+
+    results = {}
+    for name in args.endpoints or QUERY_BUDGETS:
+        results[name] = bench(
+            app, name, requests[name], args.requests, args.threads,
+            args.warmup, counter, args.seed,
+        )
+    print_results(results)
+
+    if args.output:
+        with app.app_context():
+            posts = get_db().execute('SELECT COUNT(*) FROM post').fetchone()[0]
+        with open(args.output, 'w') as f:
+            json.dump({
+                'created': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'platform': platform.platform(),
+                'posts': posts,
+                'threads': args.threads,
+                'config': config,
+                'results': results,
+            }, f, indent=2)
+
+    failures = check_queries(results) if args.check_queries else []
+    if args.compare:
+        with open(args.compare) as f:
+            failures += compare(results, json.load(f), args.tolerance)
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
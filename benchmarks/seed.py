@@ -0,0 +1,215 @@
+"""Fill a database with synthetic users, posts, tags, comments, likes and
+images, in the proportions of a busy blog.
+
+    python -m benchmarks.seed --posts 100000 bench/flaskr.sqlite
+
+The data only depends on ``--seed``, so two databases seeded with the
+same options hold the same rows.
+"""
+import argparse
+from datetime import datetime, timedelta
+import os
+import random
+
+from werkzeug.security import generate_password_hash
+
+from flaskr import create_app
+from flaskr.blog import render_body
+from flaskr.db import get_db, init_db
+from flaskr.images import hash_file, image_path
+
+PASSWORD = 'bench'
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+START = datetime(2015, 1, 1)
+CHUNK = 10000
+
+WORDS = '''
+    flask blog python server request response template database query
+    index cache page post comment like image feed search tag user session
+    thread process worker pool lock write read commit transaction schema
+    migration backend replica latency throughput benchmark profile trace
+    morning evening garden river mountain coffee music travel weekend
+    recipe bread winter summer library paper ocean forest village market
+'''.split()
+
+# a 1x1 transparent GIF
+GIF = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04'
+    b'\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D'
+    b'\x01\x00;'
+)
+
+
+def make_app(database, config=None):
+    """Create the app on *database*, with its images in a folder beside it.
+
+    Logins are cheap and unlimited, so that they don't skew the numbers.
+    """
+    images = 'bench_images'
+    if '://' not in database:
+        database = os.path.abspath(database)
+        os.makedirs(os.path.dirname(database), exist_ok=True)
+        images = os.path.splitext(database)[0] + '_images'
+    return create_app({
+        'DATABASE': database,
+        'POST_IMAGE_FOLDER': images,
+        'PASSWORD_HASH_METHOD': PASSWORD_HASH_METHOD,
+        'LOGIN_RATE_LIMIT': None,
+        'FEED_BASE_URL': 'http://localhost/',
+        **(config or {}),
+    })
+
+
+def timestamp(moment):
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def insert(sql, rows):
+    db = get_db()
+    for chunk in chunks(rows):
+        db.executemany(sql, chunk)
+    db.commit()
+
+
+def make_body(rng):
+    paragraphs = []
+    for _ in range(rng.randint(1, 6)):
+        words = rng.choices(WORDS, k=rng.randint(20, 120))
+        words[rng.randrange(len(words))] = f'*{rng.choice(WORDS)}*'
+        paragraphs.append(' '.join(words).capitalize() + '.')
+    if rng.random() < 0.3:
+        paragraphs.insert(0, f'# {rng.choice(WORDS).capitalize()}')
+    return '\n\n'.join(paragraphs)
+
+
+def seed(posts, comments=3, likes=5, images=0.1, tags=200, seed=0):
+    """Seed the database of the current app.
+
+    *comments* and *likes* are averages per post and *images* is the share
+    of posts with an image. There is a user for every 20 posts.
+    """
+    rng = random.Random(seed)
+    users = max(100, posts // 20)
+    password = generate_password_hash(PASSWORD, PASSWORD_HASH_METHOD)
+    tag_names = [f'{rng.choice(WORDS)}{n}' for n in range(tags)]
+    # a few tags are on many posts, most are on a few
+    tag_weights = [1 / (n + 1) for n in range(tags)]
+    bodies = [make_body(rng) for _ in range(64)]
+    rendered = [render_body(body) for body in bodies]
+    spacing = timedelta(days=3650) / posts
+
+    init_db()
+    insert(
+        'INSERT INTO "user" (username, password) VALUES (?, ?)',
+        ((f'user{n}', password) for n in range(1, users + 1))
+    )
+
+    post_tags = {}
+
+    def make_posts():
+        for id in range(1, posts + 1):
+            tags = list(dict.fromkeys(
+                rng.choices(tag_names, tag_weights, k=rng.randint(0, 3))
+            ))
+            post_tags[id] = tags
+            body = rng.randrange(len(bodies))
+            yield (
+                ' '.join(rng.choices(WORDS, k=rng.randint(2, 8))).title(),
+                bodies[body], ' '.join(tags), rng.randint(1, users),
+                timestamp(START + spacing * id),
+            ) + rendered[body]
+
+    insert('''
+        INSERT INTO post (
+          title, body, tags, author_id, created,
+          body_html, body_text, body_hash
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+        make_posts()
+    )
+    insert(
+        'INSERT INTO post_tag (tag, post_id) VALUES (?, ?)',
+        ((tag, id) for id, tags in post_tags.items() for tag in tags)
+    )
+
+    def make_comments():
+        for id in range(1, posts + 1):
+            created = START + spacing * id
+            for _ in range(rng.randint(0, comments * 2)):
+                created += timedelta(minutes=rng.randint(1, 600))
+                yield (
+                    ' '.join(rng.choices(WORDS, k=rng.randint(3, 40))),
+                    id, rng.randint(1, users), timestamp(created),
+                )
+
+    insert('''
+        INSERT INTO comment (body, post_id, author_id, created)
+        VALUES (?, ?, ?, ?)''',
+        make_comments()
+    )
+    insert(
+        'INSERT INTO reaction (post_id, user_id) VALUES (?, ?)',
+        (
+            (id, user)
+            for id in range(1, posts + 1)
+            for user in rng.sample(
+                range(1, users + 1), min(users, rng.randint(0, likes * 2))
+            )
+        )
+    )
+
+    with_images = [id for id in range(1, posts + 1) if rng.random() < images]
+    digest = None
+    for id in with_images:
+        path = image_path(id, '.gif')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(GIF)
+        digest = digest or hash_file(path)
+    insert('''
+        INSERT INTO post_image (post_id, ext, size, width, height, digest)
+        VALUES (?, '.gif', ?, 1, 1, ?)''',
+        ((id, len(GIF), digest) for id in with_images)
+    )
+
+    return {
+        'users': users, 'posts': posts, 'tags': tags,
+        'images': len(with_images),
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('database', help='SQLite file or postgresql:// URL')
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--comments', type=int, default=3,
+                        help='average comments per post')
+    parser.add_argument('--likes', type=int, default=5,
+                        help='average likes per post')
+    parser.add_argument('--images', type=float, default=0.1,
+                        help='share of posts with an image')
+    parser.add_argument('--tags', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(args)
+
+    app = make_app(args.database)
+    with app.app_context():
+        counts = seed(
+            args.posts, args.comments, args.likes, args.images, args.tags,
+            args.seed,
+        )
+    print(', '.join(f'{count} {name}' for name, count in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Measure how long a new worker takes to serve its first request.
+
+    python -m benchmarks.startup bench/flaskr.sqlite --runs 10
+
+Each run starts a new interpreter that imports the app, creates it and
+requests the index page twice, first with templates compiled on the spot
+and then with them loaded from a ``TEMPLATE_CACHE_DIR`` filled by
+``compile-templates``.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.run import parse_setting
+from benchmarks.seed import make_app
+
+PHASES = ('import', 'create_app', 'first_request', 'second_request')
+
+WORKER = '''
+import json, sys, time
+start = time.perf_counter()
+from benchmarks.seed import make_app
+imported = time.perf_counter()
+app = make_app(sys.argv[1], json.loads(sys.argv[2]))
+created = time.perf_counter()
+client = app.test_client()
+assert client.get('/').status_code == 200
+first = time.perf_counter()
+client.get('/')
+second = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'create_app': created - imported,
+    'first_request': first - created,
+    'second_request': second - first,
+}))
+'''
+
+
+def start_worker(database, config):
+    """Run a worker, return the seconds of its phases and in total."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', WORKER, database, json.dumps(config)],
+        cwd=root, check=True, capture_output=True, text=True,
+    ).stdout
+    timings = json.loads(output)
+    timings['total'] = time.perf_counter() - start
+    return timings
+
+
+def bench(database, config, runs):
+    timings = [start_worker(database, config) for _ in range(runs)]
+    return {
+        phase: statistics.median(run[phase] for run in timings) * 1000
+        for phase in PHASES + ('total',)
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('database', help='a database made by benchmarks.seed')
+    parser.add_argument('-r', '--runs', type=int, default=10)
+    parser.add_argument('-c', '--config', action='append', default=[],
+                        type=parse_setting, metavar='KEY=VALUE',
+                        help='app setting, like PAGE_CACHE=memory')
+    parser.add_argument('-o', '--output', help='write the results as JSON')
+    args = parser.parse_args(args)
+
+    config = dict(args.config)
+    results = {'compiled': bench(args.database, config, args.runs)}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        config['TEMPLATE_CACHE_DIR'] = cache_dir
+        make_app(args.database, config).test_cli_runner().invoke(
+            args=['compile-templates']
+        )
+        results['cached'] = bench(args.database, config, args.runs)
+
+    print(f"{'median ms':<16}{'compiled':>10}{'cached':>10}")
+    for phase in PHASES + ('total',):
+        print(
+            f'{phase:<16}' + ''.join(
+                f'{results[templates][phase]:>10.1f}'
+                for templates in ('compiled', 'cached')
+            )
+        )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'runs': args.runs, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,6 @@
 import os
 
 from flask import Flask
-from flaskext.markdown import Markdown
 
 
 def create_app(test_config=None):
@@ -9,8 +8,63 @@ def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_mapping(
         SECRET_KEY='dev',
+        # a SQLite file, or the postgresql:// URL of a server
         DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite'),
+        # a PostgreSQL replica for read-only views
+        DATABASE_READ_URL=None,
+        DATABASE_POOL_SIZE=10,
+        # seconds between checks that a logged in user still exists
+        USER_CHECK_INTERVAL=300,
+        # existing passwords are rehashed on login when this changes
+        PASSWORD_HASH_METHOD='pbkdf2:sha256:260000',
+        PASSWORD_HASH_WORKERS=2,
+        PASSWORD_HASH_TIMEOUT=10,
+        # (attempts, seconds) per client address and per username, or None
+        LOGIN_RATE_LIMIT=(10, 60),
+        # set on every new connection, see https://sqlite.org/pragma.html
+        SQLITE_PRAGMAS={
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+            'busy_timeout': 5000,
+            'mmap_size': 64 * 1024 * 1024,
+            'cache_size': -16 * 1024,
+        },
+        SQLITE_CACHED_STATEMENTS=256,
+        # seconds after which a statement is logged with its query plan
+        SLOW_QUERY_THRESHOLD=None,
         POST_IMAGE_FOLDER='post_images',
+        # requests with larger bodies are refused with 413
+        MAX_CONTENT_LENGTH=16 * 1024 * 1024,
+        IMAGE_MAX_SIZE=10 * 1024 * 1024,
+        # longest side in pixels of the downscaled copies of post images
+        IMAGE_VARIANTS={'thumb': 320, 'display': 1280},
+        IMAGE_WEBP_QUALITY=80,
+        # 0 makes the variants on the request thread
+        IMAGE_WORKERS=2,
+        # internal nginx location the image folder is served from, if any
+        IMAGE_ACCEL_REDIRECT=None,
+        # None, 'memory' or 'filesystem'
+        PAGE_CACHE=None,
+        PAGE_CACHE_TTL=300,
+        PAGE_CACHE_SIZE=1024,
+        PAGE_CACHE_DIR=None,
+        # root of the links in feeds, like 'https://blog.example.com/';
+        # by default built from SERVER_NAME, links are relative without it
+        FEED_BASE_URL=None,
+        # compiled templates shared by the workers, see compile-templates
+        TEMPLATE_CACHE_DIR=None,
+        # time statements, templates and Markdown, serve /metrics
+        INSTRUMENTATION=False,
+        # upper bounds in seconds of the request latency histograms
+        METRICS_BUCKETS=(
+            0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+        ),
+        # commit likes and comments in batches from a background thread
+        WRITE_QUEUE=False,
+        WRITE_BATCH_SIZE=200,
+        WRITE_BATCH_DELAY=0.02,
+        # seconds a user's request waits for their queued changes
+        WRITE_QUEUE_WAIT=5,
     )
 
     if test_config is None:
@@ -20,17 +74,17 @@ def create_app(test_config=None):
         # load the test config if passed in
         app.config.update(test_config)
 
-    # ensure the instance folder exists
-    try:
-        os.makedirs(app.instance_path)
-    except OSError:
-        pass
-    try:
-        os.makedirs(
-            os.path.join(app.instance_path, app.config['POST_IMAGE_FOLDER'])
-        )
-    except OSError:
-        pass
+    # ensure the instance folder and the image folder in it exist
+    images = os.path.join(app.instance_path, app.config['POST_IMAGE_FOLDER'])
+    os.makedirs(images, exist_ok=True)
+    if os.path.dirname(images) != app.instance_path:
+        os.makedirs(app.instance_path, exist_ok=True)
+
+    from . import rendering
+    rendering.init_app(app)
+
+    from . import metrics
+    metrics.init_app(app)
 
     # a simple page that says hello
     @app.route('/hello')
@@ -40,12 +94,22 @@ def create_app(test_config=None):
     from . import db
     db.init_app(app)
 
+    from . import cache
+    cache.init_app(app)
+
+    from . import images
+    images.init_app(app)
+
+    from . import writes
+    writes.init_app(app)
+
+    from . import feeds
+    feeds.init_app(app)
+
     from . import auth, blog
     app.register_blueprint(auth.bp)
     app.register_blueprint(blog.bp)
     
     app.add_url_rule('/', endpoint='index')
 
-    Markdown(app)
-
     return app
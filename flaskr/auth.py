@@ -1,11 +1,14 @@
 import functools
+import time
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for
+    Blueprint, current_app, flash, g, redirect, render_template, request,
+    session, url_for
 )
-from werkzeug.security import check_password_hash, generate_password_hash
-
 from flaskr.db import get_db
+from flaskr.passwords import (
+    check_password, hash_password, limit_login, needs_rehash
+)
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -26,8 +29,8 @@ def register():
         if error is None:
             try:
                 db.execute(
-                    "INSERT INTO user (username, password) VALUES (?, ?)",
-                    (username, generate_password_hash(password)),
+                    'INSERT INTO "user" (username, password) VALUES (?, ?)',
+                    (username, hash_password(password)),
                 )
                 db.commit()
             except db.IntegrityError:
@@ -45,20 +48,27 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        limit_login(request.remote_addr, username)
         db = get_db()
         error = None
         user = db.execute(
-            'SELECT * FROM user WHERE username = ?', (username,)
+            'SELECT * FROM "user" WHERE username = ?', (username,)
         ).fetchone()
 
         if user is None:
             error = 'Incorrect username.'
-        elif not check_password_hash(user['password'], password):
+        elif not check_password(user['password'], password):
             error = 'Incorrect password.'
+        elif needs_rehash(user['password']):
+            db.execute(
+                'UPDATE "user" SET password = ? WHERE id = ?',
+                (hash_password(password), user['id'])
+            )
+            db.commit()
 
         if error is None:
             session.clear()
-            session['user_id'] = user['id']
+            remember_user(user)
             return redirect(url_for('index'))
 
         flash(error)
@@ -66,16 +76,46 @@ def login():
     return render_template('auth/login.html.jinja')
 
 
+def remember_user(user):
+    """Keep the id and name of the logged in *user* in the session."""
+    session['user_id'] = user['id']
+    session['username'] = user['username']
+    session['user_checked'] = int(time.time())
+
+
+def without_user(view):
+    """Mark a view that doesn't need to know who is logged in."""
+    view.needs_user = False
+    return view
+
+
 @bp.before_app_request
 def load_logged_in_user():
+    """Load the user from the session without querying the database.
+
+    Every ``USER_CHECK_INTERVAL`` seconds the user is looked up again, so
+    that renamed or deleted accounts are noticed.
+    """
     user_id = session.get('user_id')
+    view = current_app.view_functions.get(request.endpoint)
 
-    if user_id is None:
+    if user_id is None or request.endpoint == 'static' \
+            or not getattr(view, 'needs_user', True):
         g.user = None
-    else:
-        g.user = get_db().execute(
-            'SELECT * FROM user WHERE id = ?', (user_id,)
+        return
+
+    checked = session.get('user_checked', 0)
+    if time.time() - checked >= current_app.config['USER_CHECK_INTERVAL']:
+        user = get_db().execute(
+            'SELECT id, username FROM "user" WHERE id = ?', (user_id,)
         ).fetchone()
+        if user is None:
+            session.clear()
+            g.user = None
+            return
+        remember_user(user)
+
+    g.user = {'id': user_id, 'username': session['username']}
 
 
 @bp.route('/logout')
@@ -0,0 +1,294 @@
+"""Database backends: SQLite files and PostgreSQL servers.
+
+The app is written against the :mod:`sqlite3` connection interface with
+``?`` placeholders; the PostgreSQL backend wraps psycopg connections to
+look the same. Each backend also has its own base schema and migrations.
+"""
+import functools
+import os
+import re
+import sqlite3
+import threading
+from urllib.parse import quote
+
+# imported by the PostgreSQL backend when it is used, as psycopg takes
+# longer to load than the rest of the app
+psycopg = None
+ConnectionPool = None
+
+
+def import_psycopg():
+    global psycopg, ConnectionPool
+    try:
+        import psycopg
+        from psycopg_pool import ConnectionPool
+    except ImportError:  # PostgreSQL support is optional
+        raise RuntimeError(
+            'PostgreSQL support needs psycopg, install flaskr[postgresql].'
+        )
+
+
+# tables of a single row, which are read whole at no cost
+SINGLE_ROW_TABLES = ('revision',)
+
+
+class SQLiteBackend:
+    """Connections to a SQLite file, kept open by each thread."""
+
+    name = 'sqlite'
+    schema = 'schema.sql'
+    migrations = 'migrations'
+    Error = sqlite3.Error
+
+    def __init__(self, app):
+        self.config = app.config
+        self._local = threading.local()
+
+    def connect(self, read_only=False):
+        config = self.config
+        if read_only:
+            database = 'file:%s?mode=ro' % quote(config['DATABASE'])
+        else:
+            database = config['DATABASE']
+        db = sqlite3.connect(
+            database,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=config['SQLITE_CACHED_STATEMENTS'],
+            uri=read_only,
+        )
+        db.row_factory = sqlite3.Row
+        for name, value in config['SQLITE_PRAGMAS'].items():
+            if not (read_only and name == 'journal_mode'):
+                db.execute(f'PRAGMA {name} = {value}')
+        if read_only:
+            db.execute('PRAGMA query_only = 1')
+        return db
+
+    def acquire(self, read_only=False):
+        """Return the connection of the current thread, opening it if needed.
+
+        Each thread keeps a read-only and a read-write connection, so the
+        pragmas run and the statements are prepared once per thread.
+        """
+        local = self._local
+        # a connection must not be shared with a forked worker process
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connections = {}
+            local.pid = os.getpid()
+        if read_only not in local.connections:
+            local.connections[read_only] = self.connect(read_only)
+        return local.connections[read_only]
+
+    def begin_write(self, db):
+        """Start a transaction that holds the write lock, so that no other
+        write commits before it ends."""
+        if not db.in_transaction:
+            db.execute('BEGIN IMMEDIATE')
+
+    def release(self, db):
+        # the connection is reused, so don't leave a transaction open in it
+        if db.in_transaction:
+            db.rollback()
+
+    def get_schema_version(self, db):
+        return db.execute('PRAGMA user_version').fetchone()[0]
+
+    def explain(self, db, sql, parameters=()):
+        """Return the query plan of *sql*, a line per step."""
+        depth = {0: -1}
+        plan = []
+        for id, parent, _, detail in db.execute(
+            'EXPLAIN QUERY PLAN ' + sql, parameters
+        ):
+            depth[id] = depth.get(parent, -1) + 1
+            plan.append('  ' * depth[id] + detail)
+        return plan
+
+    @staticmethod
+    def slow_steps(plan):
+        """Return the steps of *plan* that read a whole table, sort or
+        build a temporary index."""
+        return [
+            step for step in plan
+            if step.lstrip().startswith('SCAN ')
+            and not any(
+                word in step
+                for word in (' USING ', 'VIRTUAL TABLE', 'CONSTANT ROW')
+            )
+            and step.split()[1] not in SINGLE_ROW_TABLES
+            or 'TEMP B-TREE' in step or 'AUTOMATIC' in step
+        ]
+
+    def run_migration(self, db, script, version):
+        try:
+            db.executescript(
+                f'BEGIN;\n{script}\nPRAGMA user_version = {version};\nCOMMIT;'
+            )
+        except sqlite3.Error:
+            db.rollback()
+            raise
+
+
+@functools.lru_cache(maxsize=1024)
+def to_format_style(sql):
+    """Turn the ``?`` placeholders of *sql* into psycopg's ``%s``."""
+    def replace(match):
+        token = match.group()
+        if token == '?':
+            return '%s'
+        return token.replace('%', '%%')
+
+    return re.sub(r"'(?:[^']|'')*'|\?|%", replace, sql)
+
+
+class Row(tuple):
+    """A result row that, like :class:`sqlite3.Row`, is also a mapping."""
+
+    def __new__(cls, values, index):
+        row = super().__new__(cls, values)
+        row._index = index
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return super().__getitem__(key)
+
+    def keys(self):
+        return list(self._index)
+
+
+def row_factory(cursor):
+    index = {
+        column.name: i for i, column in enumerate(cursor.description or ())
+    }
+    return lambda values: Row(values, index)
+
+
+class PostgresConnection:
+    """A psycopg connection with the part of the sqlite3 interface we use."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    @property
+    def Error(self):
+        return psycopg.Error
+
+    @property
+    def IntegrityError(self):
+        return psycopg.IntegrityError
+
+    @property
+    def in_transaction(self):
+        status = self.connection.info.transaction_status
+        return status != psycopg.pq.TransactionStatus.IDLE
+
+    def execute(self, sql, parameters=()):
+        if not parameters:
+            return self.connection.execute(sql)
+        return self.connection.execute(to_format_style(sql), parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        cursor = self.connection.cursor()
+        cursor.executemany(to_format_style(sql), list(seq_of_parameters))
+        return cursor
+
+    def executescript(self, script):
+        self.connection.execute(script)
+        self.connection.commit()
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+class PostgresBackend:
+    """Connections to a PostgreSQL server, from a pool per process.
+
+    Read-only views get their connections from ``DATABASE_READ_URL``,
+    which can point at a replica, in read-only transactions.
+    """
+
+    name = 'postgresql'
+    schema = 'postgresql/schema.sql'
+    migrations = 'postgresql/migrations'
+
+    def __init__(self, app):
+        import_psycopg()
+        self.Error = psycopg.Error
+        config = app.config
+        self._pools = {}
+        for read_only, url in (
+            (False, config['DATABASE']),
+            (True, config['DATABASE_READ_URL'] or config['DATABASE']),
+        ):
+            self._pools[read_only] = ConnectionPool(
+                url,
+                max_size=config['DATABASE_POOL_SIZE'],
+                kwargs={'row_factory': row_factory},
+                configure=self._set_read_only if read_only else None,
+                open=True,
+            )
+
+    @staticmethod
+    def _set_read_only(connection):
+        connection.read_only = True
+
+    def acquire(self, read_only=False):
+        return PostgresConnection(self._pools[read_only].getconn())
+
+    def begin_write(self, db):
+        # every post write updates the revision row, so they wait for this
+        db.execute('SELECT id FROM revision FOR UPDATE')
+
+    def release(self, db):
+        # a SELECT leaves a transaction open, which the pool would roll
+        # back with a warning
+        if db.in_transaction:
+            db.rollback()
+        connection = db.connection
+        self._pools[bool(connection.read_only)].putconn(connection)
+
+    def get_schema_version(self, db):
+        return db.execute('SELECT version FROM schema_version').fetchone()[0]
+
+    def explain(self, db, sql, parameters=()):
+        return [row[0] for row in db.execute('EXPLAIN ' + sql, parameters)]
+
+    @staticmethod
+    def slow_steps(plan):
+        return [
+            step for step in plan
+            if 'Seq Scan' in step
+            and re.search(r'Seq Scan on "?(\w+)', step).group(1)
+            not in SINGLE_ROW_TABLES
+            or step.lstrip(' ->').startswith('Sort ')
+        ]
+
+    def run_migration(self, db, script, version):
+        try:
+            db.connection.execute(script)
+            db.execute('UPDATE schema_version SET version = ?', (version,))
+            db.commit()
+        except psycopg.Error:
+            db.rollback()
+            raise
+
+
+def make_backend(app):
+    database = app.config['DATABASE']
+    if database.startswith(('postgresql://', 'postgres://')):
+        return PostgresBackend(app)
+    return SQLiteBackend(app)
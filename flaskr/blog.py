@@ -1,66 +1,160 @@
+from calendar import timegm
+from datetime import datetime, timezone
+from hashlib import sha1
+import functools
 from math import floor
-from pathlib import Path
-import glob
+import mimetypes
 
+import click
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, url_for,
-    current_app, send_from_directory, Response
+    Blueprint, flash, g, redirect, render_template, request, session,
+    url_for, current_app, make_response, send_from_directory
 )
 from werkzeug.exceptions import abort
-
-from flaskr.auth import login_required
-from flaskr.db import get_db
+from werkzeug.http import is_resource_modified
+
+from flaskr.auth import login_required, without_user
+from flaskr.cache import cache_tags, cached, invalidate
+from flaskr.db import get_backend, get_db, read_only
+from flaskr.feeds import FORMATS, feed_name, get_feed, refresh_feeds
+from flaskr.images import (
+    ALLOWED_EXTENSIONS, get_image_record, image_folder, image_url,
+    receive_image, remove_image, save_image, schedule_variants,
+    select_variant, store_digest, variant_sizes
+)
+from flaskr.writes import submit
 
 
 POSTS_PER_PAGE = 5
-ALLOWED_EXTENSIONS = {'.jpe', '.jpg', '.jpeg', '.gif', '.png', '.bmp', '.webp'}
+# range of the integers SQLite stores
+MIN_INTEGER, MAX_INTEGER = -2 ** 63, 2 ** 63 - 1
+# how each database backend finds posts for a search query, the only
+# parameter: a join that keeps the matches and an order by relevance
+SEARCH_SQL = {
+    'sqlite': (
+        'JOIN post_fts ON post_fts.rowid = p.id AND post_fts MATCH ?',
+        'bm25(post_fts, 10.0, 1.0, 5.0), p.created DESC',
+    ),
+    'postgresql': (
+        "JOIN to_tsquery('simple', ?) query ON p.search @@ query",
+        'ts_rank(p.search, query) DESC, p.created DESC',
+    ),
+}
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+# how long an original served in place of a variant that isn't made yet
+# may be cached
+IMAGE_FALLBACK_MAX_AGE = 60
+IMAGE_EXTENSION = 'any(%s)' % ', '.join(
+    sorted(ext[1:] for ext in ALLOWED_EXTENSIONS)
+)
 
-bp = Blueprint('blog', __name__)
+bp = Blueprint('blog', __name__, cli_group=None)
+
+
+def conditional(get_revision):
+    """Answer with ``304 Not Modified`` when the client copy is current.
+
+    *get_revision* takes the view arguments and returns a version string
+    and modification time of the content, or None to always run the view.
+    The validators also depend on the user, since pages differ per user.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped_view(**kwargs):
+            if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                return view(**kwargs)
+            revision = get_revision(**kwargs)
+            if revision is None:
+                return view(**kwargs)
+
+            version, modified = revision
+            etag = f"{version}-{g.user['id'] if g.user else 0}"
+            if is_resource_modified(
+                request.environ, etag=etag, last_modified=modified
+            ):
+                response = make_response(view(**kwargs))
+            else:
+                response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            response.last_modified = modified
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+
+        return wrapped_view
+
+    return decorator
+
+
+def site_revision(**kwargs):
+    revision = get_db().execute(
+        'SELECT version, modified FROM revision'
+    ).fetchone()
+    return f"site-{revision['version']}", revision['modified']
+
+
+def post_revision(id):
+    post = get_db().execute(
+        'SELECT version, modified, created FROM post WHERE id = ?',
+        (id,)
+    ).fetchone()
+    if post is not None:
+        modified = post['modified'] or post['created']
+        return f"post-{id}-{post['version']}", modified
 
 
 @bp.route('/')
 @bp.route('/tag/<tag>')
+@cached
+@conditional(site_revision)
+@read_only
 def index(tag=None):
     search = request.args.get('search')
-    try:
-        start = int(request.args.get('start'))
-    except (ValueError, TypeError):
-        start = 0
+    cache_tags('posts')
+
+    source = 'post p'
+    conditions = []
+    values = ()
+    backend = get_backend().name
+    match = search_query(search, backend)
+    if match:
+        search_join, search_order = SEARCH_SQL[backend]
+        source += ' ' + search_join
+        values += (match,)
+    if tag:
+        source += ' JOIN post_tag pt ON pt.post_id = p.id'
+        conditions.append('pt.tag = ?')
+        values += (tag,)
+    if match:
+        # relevance order has no index to seek on, so ranked results
+        # are still paged by offset
+        try:
+            start = max(int(request.args.get('start')), 0)
+        except (ValueError, TypeError):
+            start = 0
+        posts = select_posts(
+            source, conditions, values, search_order, offset=start
+        )
+        prv = {'start': max(start - POSTS_PER_PAGE, 0)} if start > 0 else None
+        nxt = {'start': start + POSTS_PER_PAGE} \
+            if len(posts) > POSTS_PER_PAGE else None
+        current_page = floor((start - 1) / POSTS_PER_PAGE) + 2
     else:
-        start = max(start, 0)
-
-    db = get_db()
-    where_order_request = '''
-        WHERE " " || tags || " " LIKE ?
-        AND title LIKE ?
-        ORDER BY created DESC
-    '''
-    where_values = (
-        f'% {tag} %' if tag else '%',
-        f'%{search}%' if search else '%',
-    )
-    posts = db.execute('''
-        SELECT p.id, title, body, created, author_id, username
-        FROM post p JOIN user u ON p.author_id = u.id'''
-        + where_order_request + 'LIMIT ? OFFSET ?',
-        where_values + (POSTS_PER_PAGE, start),
-    ).fetchall()
-    last = db.execute(
-        'SELECT COUNT(*) AS c FROM post' + where_order_request,
-        where_values,
-    ).fetchone()['c'] - 1
+        posts, prv, nxt, current_page = select_page(
+            source, conditions, values,
+            page=max(request.args.get('page', 1, type=int), 1),
+            after=parse_cursor(request.args.get('after')),
+            before=parse_cursor(request.args.get('before')),
+        )
+    posts = posts[:POSTS_PER_PAGE]
+    cache_tags(*(f"post:{post['id']}" for post in posts))
 
-    reactions = [get_reactions(post['id']) for post in posts]
-    comments = [get_comments(post['id']) for post in posts]
-    prv = max(start - POSTS_PER_PAGE, 0) if start > 0 else None
-    nxt = start + POSTS_PER_PAGE if start + POSTS_PER_PAGE <= last else None
-    current_page = floor((start - 1) / POSTS_PER_PAGE) + 2
+    liked = get_liked([post['id'] for post in posts])
 
     return render_template(
         'blog/index.html.jinja',
         posts=posts,
-        reactions=reactions,
-        comments=comments,
+        liked=liked,
         tag=tag,
         search=search,
         prev=prv,
@@ -69,35 +163,133 @@ def index(tag=None):
     )
 
 
+def select_posts(source, conditions, values, order, offset=0):
+    """Fetch one page of posts plus one extra row to detect a next page."""
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    return get_db().execute(f'''
+        SELECT p.id, p.title, p.body, p.body_text, p.created, p.author_id,
+               u.username, p.like_count, p.comment_count
+        FROM {source} JOIN "user" u ON p.author_id = u.id
+        {where}
+        ORDER BY {order}
+        LIMIT ? OFFSET ?''',
+        values + (POSTS_PER_PAGE + 1, offset),
+    ).fetchall()
+
+
+def select_page(source, conditions, values, page, after=None, before=None):
+    """Keyset pagination over posts, newest first.
+
+    *after* and *before* are ``(timestamp, id)`` cursors of the last post on
+    the previous page or the first post on the next one, so SQLite seeks
+    straight to the page through the index on ``post.created`` instead of
+    skipping every earlier row.
+    """
+    if before:
+        posts = select_posts(
+            source,
+            conditions + ['(p.created, p.id) > (?, ?)'],
+            values + cursor_values(before),
+            'p.created, p.id',
+        )
+        if len(posts) > POSTS_PER_PAGE:
+            posts = posts[POSTS_PER_PAGE - 1::-1]
+            prv = {'before': make_cursor(posts[0]), 'page': page - 1}
+            nxt = {'after': make_cursor(posts[-1]), 'page': page + 1}
+            return posts, prv, nxt, page
+        # walked back to the newest posts, show the first page instead
+        after, page = None, 1
+
+    if after:
+        conditions = conditions + ['(p.created, p.id) < (?, ?)']
+        values = values + cursor_values(after)
+    posts = select_posts(
+        source, conditions, values, 'p.created DESC, p.id DESC'
+    )
+    prv = nxt = None
+    if after and posts:
+        prv = {'before': make_cursor(posts[0]), 'page': page - 1} \
+            if page > 2 else {}
+    if len(posts) > POSTS_PER_PAGE:
+        nxt = {
+            'after': make_cursor(posts[POSTS_PER_PAGE - 1]),
+            'page': page + 1,
+        }
+    return posts, prv, nxt, page
+
+
+def make_cursor(post):
+    return f"{timegm(post['created'].timetuple())}-{post['id']}"
+
+
+def parse_cursor(cursor):
+    try:
+        timestamp, id = map(int, cursor.split('-'))
+    except (AttributeError, ValueError):
+        return None
+    if not MIN_INTEGER <= id <= MAX_INTEGER \
+            or cursor_values((timestamp, id)) is None:
+        return None
+    return timestamp, id
+
+
+def cursor_values(cursor):
+    """Return query parameters that compare to ``(created, id)`` columns,
+    or None if the timestamp is out of range."""
+    timestamp, id = cursor
+    try:
+        created = datetime.fromtimestamp(timestamp, timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        return None
+    return created.strftime('%Y-%m-%d %H:%M:%S'), id
+
+
+def search_query(search, backend='sqlite'):
+    """Build a full-text query for *backend* from the search box.
+
+    Every search word becomes a quoted prefix term so user input can't
+    inject search operators; an empty string means no filtering at all.
+    """
+    words = (search or '').split()
+    if backend == 'postgresql':
+        return ' & '.join(
+            "'%s':*" % word.replace('\\', '\\\\').replace("'", "''")
+            for word in words
+        )
+    return ' '.join('"%s"*' % word.replace('"', '""') for word in words)
+
+
 def make_tag_list(tags_string):
     return [tag for tag in tags_string.split(' ') if tag]
 
 
-def allowed_file(filename):
-    return '.' in filename and \
-           Path(filename).suffix.lower() in ALLOWED_EXTENSIONS
+def hash_body(body):
+    return sha1(body.encode('utf8')).hexdigest()
 
 
-def image_path(id, orig_filename=None):
-    root_dir = Path(
-        current_app.instance_path,
-        current_app.config['POST_IMAGE_FOLDER']
-    )
-    if orig_filename:
-        return Path(root_dir, str(id)).with_suffix(Path(orig_filename).suffix)
-    else:
-        paths = glob.glob(f'{id}*', root_dir=root_dir)
-        if paths:
-            return Path(current_app.config['POST_IMAGE_FOLDER'], paths[0])
+def render_body(body):
+    """Render post Markdown once so views don't have to on every request.
 
+    Returns the HTML, its plain text for excerpts and feeds, and the hash
+    of *body* the two were rendered from.
+    """
+    html = current_app.jinja_env.filters['markdown'](body)
+    return str(html), html.striptags(), hash_body(body)
 
-def remove_images(id):
-    root_dir = Path(
-        current_app.instance_path,
-        current_app.config['POST_IMAGE_FOLDER']
+
+def save_tags(post_id, tags):
+    db = get_db()
+    db.execute('DELETE FROM post_tag WHERE post_id = ?', (post_id,))
+    db.executemany(
+        'INSERT INTO post_tag (tag, post_id) VALUES (?, ?)',
+        [(tag, post_id) for tag in dict.fromkeys(tags)]
     )
-    for path in glob.glob(f'{id}*', root_dir=root_dir):
-        Path(root_dir, path).unlink()
+
+
+def get_tag_counts():
+    return get_db().execute(
+        'SELECT name, post_count FROM tag ORDER BY post_count DESC, name'
+    ).fetchall()
 
 
 @bp.route('/create', methods=('GET', 'POST'))
@@ -109,29 +301,46 @@ def create():
         tags = make_tag_list(request.form['tags'])
         error = None
 
+        upload = None
+
         if not title:
             error = 'Title is required.'
         elif 'image' not in request.files:
             error = 'No file part.'
-        else:
-            file = request.files['image']
-            if file.filename and file and not allowed_file(file.filename):
-                error = 'Invalid image file type.'
+        elif request.files['image'].filename:
+            try:
+                upload = receive_image(request.files['image'])
+            except ValueError as e:
+                error = str(e)
 
         if error is not None:
             flash(error)
         else:
             db = get_db()
-            db.execute('''
-                INSERT INTO post (title, body, author_id, tags)
-                VALUES (?, ?, ?, ?)''',
-                (title, body, g.user['id'], ' '.join(tags))
-            )
-            db.commit()
-            id = db.execute('SELECT LAST_INSERT_ROWID() id').fetchone()['id']
-            if file.filename:
-                path = image_path(id, file.filename)
-                file.save(path)
+            try:
+                id = db.execute('''
+                    INSERT INTO post (
+                      title, body, author_id, tags,
+                      body_html, body_text, body_hash
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    RETURNING id''',
+                    (title, body, g.user['id'], ' '.join(tags))
+                    + render_body(body)
+                ).fetchone()['id']
+                save_tags(id, tags)
+                if upload is not None:
+                    save_image(id, upload)
+                refresh_feeds(tags, [g.user['id']])
+                db.commit()
+            except BaseException:
+                # the temporary file would be left behind
+                if upload is not None:
+                    upload[0].unlink(missing_ok=True)
+                raise
+            invalidate('posts')
+            if upload is not None:
+                schedule_variants(id)
             return redirect(url_for('blog.read', id=str(id)))
 
     return render_template('blog/create.html.jinja')
@@ -139,8 +348,13 @@ def create():
 
 def get_post(id, check_author=True):
     post = get_db().execute('''
-        SELECT p.id, title, body, created, author_id, username, tags
-        FROM post p JOIN user u ON p.author_id = u.id
+        SELECT p.id, title, body, body_html, created, author_id, username,
+               tags, like_count, comment_count,
+               i.ext AS image_ext, i.digest AS image_digest,
+               i.width AS image_width, i.height AS image_height,
+               i.variants AS image_variants
+        FROM post p JOIN "user" u ON p.author_id = u.id
+        LEFT JOIN post_image i ON i.post_id = p.id
         WHERE p.id = ?''',
         (id,)
     ).fetchone()
@@ -154,18 +368,22 @@ def get_post(id, check_author=True):
     return post
 
 
-def get_reactions(post_id):
-    reactions = get_db().execute(
-        'SELECT user_id FROM reaction WHERE post_id = ?',
-        (post_id,)
+def get_liked(post_ids):
+    """Return which of *post_ids* the logged in user has liked."""
+    if g.user is None or not post_ids:
+        return set()
+    rows = get_db().execute(
+        'SELECT post_id FROM reaction WHERE user_id = ? AND post_id IN (%s)'
+        % ', '.join('?' * len(post_ids)),
+        (g.user['id'], *post_ids)
     ).fetchall()
-    return [reaction['user_id'] for reaction in reactions]
+    return {row['post_id'] for row in rows}
 
 
 def get_comments(post_id):
     comments = get_db().execute('''
         SELECT c.id, body, created, author_id, username
-        FROM comment c JOIN user u ON c.author_id = u.id
+        FROM comment c JOIN "user" u ON c.author_id = u.id
         WHERE post_id = ?
         ORDER BY created DESC''',
         (post_id,)
@@ -176,7 +394,7 @@ def get_comments(post_id):
 def get_comment(id, check_author=True):
     comment = get_db().execute('''
         SELECT c.id, body, created, author_id, post_id, username
-        FROM comment c JOIN user u ON c.author_id = u.id
+        FROM comment c JOIN "user" u ON c.author_id = u.id
         WHERE c.id = ?''',
         (id,)
     ).fetchone()
@@ -191,17 +409,26 @@ def get_comment(id, check_author=True):
 
 
 @bp.route('/<int:id>')
+@cached
+@conditional(post_revision)
+@read_only
 def read(id):
+    cache_tags(f'post:{id}')
     post = get_post(id, check_author=False)
-    reactions = get_reactions(id)
+    liked = id in get_liked([id])
     comments = get_comments(id)
     tags = make_tag_list(post['tags'])
-    path = image_path(id)
-    ext = path and path.suffix
+    # only the variants that are made are linked
+    variants = (post['image_variants'] or '').split()
+    image_sizes = {
+        variant: size for variant, size
+        in variant_sizes(post['image_width'], post['image_height']).items()
+        if variant in variants
+    }
     return render_template(
         'blog/read.html.jinja',
-        post=post, reactions=reactions, comments=comments, tags=tags,
-        image_ext=ext,
+        post=post, liked=liked, comments=comments, tags=tags,
+        image_sizes=image_sizes,
     )
 
 
@@ -216,29 +443,46 @@ def update(id):
         tags = make_tag_list(request.form['tags'])
         error = None
 
+        upload = None
+
         if not title:
             error = 'Title is required.'
         elif 'image' not in request.files:
             error = 'No file part.'
-        else:
-            file = request.files['image']
-            if file.filename and file and not allowed_file(file.filename):
-                error = 'Invalid image file type.'
+        elif request.files['image'].filename:
+            try:
+                upload = receive_image(request.files['image'])
+            except ValueError as e:
+                error = str(e)
 
         if error is not None:
             flash(error)
         else:
             db = get_db()
-            db.execute('''
-                UPDATE post SET title = ?, body = ?, tags = ?
-                WHERE id = ?''',
-                (title, body, ' '.join(tags), id)
-            )
-            db.commit()
-            remove_images(id)
-            if file.filename:
-                path = image_path(id, file.filename)
-                file.save(path)
+            try:
+                db.execute('''
+                    UPDATE post SET
+                      title = ?, body = ?, tags = ?,
+                      body_html = ?, body_text = ?, body_hash = ?
+                    WHERE id = ?''',
+                    (title, body, ' '.join(tags)) + render_body(body) + (id,)
+                )
+                save_tags(id, tags)
+                remove_image(id)
+                if upload is not None:
+                    save_image(id, upload)
+                refresh_feeds(
+                    {*post['tags'].split(), *tags}, [post['author_id']]
+                )
+                db.commit()
+            except BaseException:
+                # the temporary file would be left behind
+                if upload is not None:
+                    upload[0].unlink(missing_ok=True)
+                raise
+            invalidate('posts', f'post:{id}')
+            if upload is not None:
+                schedule_variants(id)
             return redirect(url_for('blog.read', id=id))
 
     return render_template('blog/update.html.jinja', post=post)
@@ -247,11 +491,13 @@ def update(id):
 @bp.route('/<int:id>/delete', methods=('POST',))
 @login_required
 def delete(id):
-    get_post(id)
+    post = get_post(id)
     db = get_db()
+    remove_image(id)
     db.execute('DELETE FROM post WHERE id = ?', (id,))
+    refresh_feeds(post['tags'].split(), [post['author_id']])
     db.commit()
-    remove_images(id)
+    invalidate('posts', f'post:{id}')
     return redirect(url_for('blog.index'))
 
 
@@ -259,21 +505,8 @@ def delete(id):
 @login_required
 def like(id):
     post = get_post(id, check_author=False)
-    liked = g.user['id'] in get_reactions(post['id'])
-    db = get_db()
-    if liked:
-        db.execute('''
-            DELETE FROM reaction
-            WHERE post_id = ? AND user_id = ?''',
-            (post['id'], g.user['id'])
-        )
-    else:
-        db.execute('''
-            INSERT INTO reaction (post_id, user_id)
-            VALUES (?, ?)''',
-            (post['id'], g.user['id'])
-        )
-    db.commit()
+    liked = post['id'] in get_liked([post['id']])
+    submit(g.user['id'], 'react', post['id'], not liked)
     return redirect(url_for('blog.read', id=id))
 
 
@@ -287,15 +520,9 @@ def comment(id):
 
     if error is not None:
         flash(error)
-        return read(id)
+        return read(id=id)
     else:
-        db = get_db()
-        db.execute('''
-            INSERT INTO comment (body, author_id, post_id)
-            VALUES (?, ?, ?)''',
-            (body, g.user['id'], id)
-        )
-        db.commit()
+        submit(g.user['id'], 'comment', body, g.user['id'], id)
         return redirect(url_for('blog.read', id=id))
 
 
@@ -306,28 +533,146 @@ def delete_comment(id):
     db = get_db()
     db.execute('DELETE FROM comment WHERE id = ?', (id,))
     db.commit()
+    invalidate(f"post:{comment['post_id']}")
     return redirect(url_for('blog.read', id=comment['post_id']))
 
 
-@bp.route('/<id>/image<ext>')
-def get_image(id, ext):
-    root_dir = Path(
-        current_app.instance_path,
-        current_app.config['POST_IMAGE_FOLDER']
+@bp.route(
+    f'/<int:id>/image-<string(length=16):digest>.<{IMAGE_EXTENSION}:ext>'
+)
+@read_only
+@without_user
+def get_image(id, digest, ext):
+    image = get_image_record(id)
+    if image is None or image['digest'] != digest:
+        abort(404)
+
+    variant = request.args.get('size')
+    filename, exact = select_variant(
+        id, image['ext'], variant,
+        'image/webp' in request.headers.get('Accept', '')
+    )
+    response = send_image(filename, f'{digest}-{filename}', immutable=exact)
+    if variant:
+        response.vary.add('Accept')
+    return response
+
+
+def send_image(filename, etag, immutable=True):
+    """Send an image file that never changes under its URL, or, if not
+    *immutable*, that is cached only for a minute.
+
+    With ``IMAGE_ACCEL_REDIRECT`` set only the headers are sent and the
+    front proxy serves the file from that internal location. Flask's
+    ``USE_X_SENDFILE`` does the same for servers using ``X-Sendfile``.
+    """
+    max_age = IMAGE_MAX_AGE if immutable else IMAGE_FALLBACK_MAX_AGE
+    prefix = current_app.config['IMAGE_ACCEL_REDIRECT']
+    if prefix:
+        response = current_app.response_class(
+            mimetype=mimetypes.guess_type(filename)[0]
+        )
+        response.headers['X-Accel-Redirect'] = \
+            f"{prefix.rstrip('/')}/{filename}"
+        response.set_etag(etag)
+        response.make_conditional(request)
+    else:
+        response = send_from_directory(
+            image_folder(), filename, etag=etag, max_age=max_age
+        )
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.cache_control.immutable = immutable
+    return response
+
+
+@bp.route('/<int:id>/image.<ext>')
+@without_user
+def get_legacy_image(id, ext):
+    image = get_image_record(id)
+    if image is None:
+        abort(404)
+
+    digest = image['digest']
+    if digest is None:
+        digest = store_digest(id, image['ext'])
+        get_db().commit()
+    return redirect(
+        image_url(id, image['ext'], digest, request.args.get('size'))
     )
-    return send_from_directory(root_dir, f'{id}{ext}')
 
 
-@bp.route('/rss.xml')
-def get_rss():
+@bp.route('/tags')
+@cached
+@conditional(site_revision)
+@read_only
+def tag_cloud():
+    cache_tags('posts')
+    return render_template('blog/tags.html.jinja', tags=get_tag_counts())
+
+
+def send_feed(name, get_title):
+    feed = get_feed(name, get_title)
+    if feed is None:
+        abort(404)
+    get_db().commit()
+
+    response = current_app.response_class(
+        feed['body'], mimetype=FORMATS[name.partition(':')[0]]
+    )
+    response.set_etag(feed['etag'])
+    response.last_modified = feed['updated']
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@bp.route('/<any(rss, atom):format>.xml')
+@without_user
+def get_feed_of_site(format):
+    return send_feed(format, lambda: 'Flaskr')
+
+
+@bp.route('/tag/<tag>/<any(rss, atom):format>.xml')
+@without_user
+def get_feed_of_tag(tag, format):
+    def get_title():
+        if get_db().execute(
+            'SELECT 1 FROM tag WHERE name = ?', (tag,)
+        ).fetchone() is not None:
+            return f'Flaskr: posts with tag “{tag}”'
+
+    return send_feed(feed_name(format, f'tag:{tag}'), get_title)
+
+
+@bp.route('/author/<username>/<any(rss, atom):format>.xml')
+@without_user
+def get_feed_of_author(username, format):
+    author = get_db().execute(
+        'SELECT id FROM "user" WHERE username = ?', (username,)
+    ).fetchone()
+    if author is None:
+        abort(404)
+    return send_feed(
+        feed_name(format, f"author:{author['id']}"),
+        lambda: f'Flaskr: posts by {username}',
+    )
+
+
+@bp.cli.command('render-posts')
+@click.option('--all', 'render_all', is_flag=True, help='Render every post.')
+def render_posts_command(render_all):
+    """Cache rendered Markdown of posts added or edited outside the app."""
     db = get_db()
-    posts = db.execute('''
-        SELECT id, title, body, created
-        FROM post
-        ORDER BY created DESC
-        LIMIT 20''',
-    ).fetchall()
-    return Response(
-        render_template('rss.xml.jinja', posts=posts),
-        mimetype='application/rss+xml',
+    stale = [
+        (row['id'], row['body'])
+        for row in db.execute('SELECT id, body, body_hash FROM post')
+        if render_all or row['body_hash'] != hash_body(row['body'])
+    ]
+    db.executemany(
+        '''UPDATE post SET body_html = ?, body_text = ?, body_hash = ?
+        WHERE id = ?''',
+        (render_body(body) + (id,) for id, body in stale)
     )
+    db.commit()
+    click.echo(f'Rendered {len(stale)} posts.')
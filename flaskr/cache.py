@@ -0,0 +1,282 @@
+"""Response cache for pages that look the same to every anonymous visitor.
+
+Cached pages are tagged with what they show (``posts`` for any listing,
+``post:<id>`` for each post on the page) and the write paths in
+:mod:`flaskr.blog` invalidate exactly the tags they touch.
+"""
+from collections import OrderedDict
+from hashlib import sha1
+from uuid import uuid4
+import functools
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+from flask import (
+    current_app, g, jsonify, make_response, request, session
+)
+
+
+class MemoryCache:
+    """Per-process LRU cache whose entries expire after *ttl* seconds."""
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileSystemCache:
+    """Cache shared by the workers of one host, a pickle file per key.
+
+    Expired files are deleted when read. A worker that has added more than
+    *max_entries* files deletes the oldest, down to three quarters of that.
+    The count of entries is the worker's own estimate, the folder is only
+    listed to prune it.
+    """
+
+    def __init__(self, path, max_entries=1024, ttl=300):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        os.makedirs(path, exist_ok=True)
+        self._count = len(self._entries())
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.path, sha1(key.encode('utf8')).hexdigest())
+
+    def _entries(self):
+        # files being written start with a dot
+        return [
+            entry for entry in os.scandir(self.path)
+            if not entry.name.startswith('.')
+        ]
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # already removed by another worker
+            return False
+        return True
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires < time.time():
+            if self._remove(path):
+                with self._lock:
+                    self._count -= 1
+            return None
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        new = not os.path.exists(path)
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((time.time() + self.ttl, value), f)
+        os.replace(tmp, path)
+        if new:
+            with self._lock:
+                self._count += 1
+                full = self._count > self.max_entries
+            if full:
+                self.prune()
+
+    def prune(self):
+        """Delete the oldest files, down to three quarters of
+        *max_entries*."""
+        mtimes = []
+        for entry in self._entries():
+            try:
+                mtimes.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+        mtimes.sort()
+        excess = max(len(mtimes) - self.max_entries * 3 // 4, 0)
+        for _, path in mtimes[:excess]:
+            self._remove(path)
+        with self._lock:
+            self._count = len(mtimes) - excess
+
+    def __len__(self):
+        return max(self._count, 0)
+
+
+class PageCache:
+    """Rendered responses tagged with what they show.
+
+    Every tag has a token in the backend, the time it was invalidated and a
+    random id. An entry remembers the tokens of its tags when it was
+    rendered, and invalidating a tag just replaces its token, so it takes
+    one write however many pages carry it.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.backend.get('page:' + key)
+        if entry is not None:
+            tokens, value = entry
+            if all(
+                self.backend.get('tag:' + tag) == token
+                for tag, token in tokens.items()
+            ):
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key, value, tokens):
+        self.backend.set('page:' + key, (tokens, value))
+
+    def token(self, tag):
+        token = self.backend.get('tag:' + tag)
+        if token is None:
+            # not invalidated as far as the backend remembers
+            token = (0.0, uuid4().hex)
+            self.backend.set('tag:' + tag, token)
+        return token
+
+    def invalidate(self, *tags):
+        now = time.time()
+        for tag in tags:
+            self.backend.set('tag:' + tag, (now, uuid4().hex))
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.backend),
+        }
+
+
+def make_cache(app):
+    backend = app.config['PAGE_CACHE']
+    ttl = app.config['PAGE_CACHE_TTL']
+
+    if backend == 'memory':
+        return PageCache(MemoryCache(app.config['PAGE_CACHE_SIZE'], ttl))
+    elif backend == 'filesystem':
+        path = app.config['PAGE_CACHE_DIR'] \
+            or os.path.join(app.instance_path, 'page_cache')
+        return PageCache(
+            FileSystemCache(path, app.config['PAGE_CACHE_SIZE'], ttl)
+        )
+    elif backend is not None:
+        raise ValueError(f'Unknown page cache backend {backend!r}.')
+
+
+def get_cache():
+    """Return the page cache of the current app, or None if disabled."""
+    extensions = current_app.extensions
+    if 'page_cache' not in extensions:
+        extensions['page_cache'] = make_cache(current_app)
+    return extensions['page_cache']
+
+
+def cache_tags(*tags):
+    """Tag the page being rendered.
+
+    Call it before loading the data of the tags, or right after for tags
+    only known from the data, like the posts of a listing. The page isn't
+    cached if one of its tags is invalidated while the view runs.
+    """
+    tokens = g.get('cache_tokens')
+    if tokens is not None:
+        cache = get_cache()
+        tokens.update((tag, cache.token(tag)) for tag in tags)
+
+
+def invalidate(*tags):
+    cache = get_cache()
+    if cache is not None:
+        cache.invalidate(*tags)
+
+
+def cached(view):
+    """Serve the view from the page cache to anonymous visitors."""
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        cache = get_cache()
+        if (
+            cache is None
+            or g.user is not None
+            or request.method not in ('GET', 'HEAD')
+            or '_flashes' in session
+        ):
+            return view(**kwargs)
+
+        key = request.full_path
+        value = cache.get(key)
+        if value is not None:
+            body, status, headers = value
+            response = current_app.response_class(body, status, headers)
+            response.headers['X-Cache'] = 'HIT'
+            return response.make_conditional(request)
+
+        g.cache_tokens = {}
+        started = time.time()
+        response = make_response(view(**kwargs))
+        tokens = g.pop('cache_tokens')
+        if (
+            response.status_code == 200 and tokens
+            # the view may have loaded the data from before the change
+            and all(
+                invalidated < started for invalidated, _ in tokens.values()
+            )
+        ):
+            headers = [
+                header for header in response.headers
+                if header[0].lower() != 'set-cookie'
+            ]
+            cache.set(
+                key, (response.get_data(), response.status_code, headers),
+                tokens
+            )
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    return wrapped_view
+
+
+def cache_stats():
+    cache = get_cache()
+    return jsonify(cache.stats() if cache is not None else {})
+
+
+def init_app(app):
+    app.add_url_rule('/cache/stats', 'cache_stats', cache_stats)
@@ -1,33 +1,183 @@
-import sqlite3
+from io import BytesIO
+import logging
+import os
 
 import click
-from flask import current_app, g
+from flask import current_app, g, has_request_context, request
+from flask.cli import with_appcontext
+
+from flaskr.backends import make_backend
+from flaskr.metrics import TimedConnection
+
+logger = logging.getLogger(__name__)
+
+
+def get_backend():
+    """Return the database backend of the current app.
+
+    ``DATABASE`` is the path of a SQLite file or a ``postgresql://`` URL.
+    """
+    extensions = current_app.extensions
+    if 'db_backend' not in extensions:
+        extensions['db_backend'] = make_backend(current_app)
+    return extensions['db_backend']
+
+
+def read_only(view):
+    """Mark a view that never writes, so it runs on the read connection.
+
+    Readers then never queue behind the connection that writes, which
+    under WAL lets any number of them run alongside a write.
+    """
+    view.read_only = True
+    return view
+
+
+def in_read_only_view():
+    if not has_request_context():
+        return False
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, 'read_only', False)
 
 
 def get_db():
-    if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+    """Return the database connection for the current context.
+
+    Views marked with :func:`read_only` get a connection that can't write.
+    """
+    name = 'read_db' if in_read_only_view() else 'db'
+    if name not in g:
+        db = get_backend().acquire(read_only=name == 'read_db')
+        # the statements of instrumented requests are timed
+        if 'queries' in g:
+            db = TimedConnection(db, g.queries)
+        setattr(g, name, db)
 
-    return g.db
+    return getattr(g, name)
 
 
 def close_db(e=None):
-    db = g.pop('db', None)
+    for name in ('db', 'read_db'):
+        db = g.pop(name, None)
+        if db is not None:
+            get_backend().release(db)
+
+
+def start_query_log():
+    if current_app.config['SLOW_QUERY_THRESHOLD'] is not None:
+        g.setdefault('queries', [])
+
+
+def explain(db, sql, parameters):
+    backend = get_backend()
+    # explain on the connection itself, so the plan isn't logged too
+    db = getattr(db, 'wrapped', db)
+    try:
+        return backend.explain(db, sql, parameters)
+    except backend.Error as e:
+        return [f'not explained: {e}']
 
-    if db is not None:
-        db.close()
+
+def log_slow_queries(e=None):
+    """Log the statements of the request that took longer than
+    ``SLOW_QUERY_THRESHOLD`` seconds, with their parameters and plan."""
+    threshold = current_app.config['SLOW_QUERY_THRESHOLD']
+    queries = g.get('queries')
+    db = g.get('db') or g.get('read_db')
+    if threshold is None or not queries or db is None:
+        return
+
+    for sql, parameters, seconds in queries:
+        if seconds < threshold:
+            continue
+        plan = explain(db, sql, parameters) if parameters is not None \
+            else ['not explained: a script']
+        logger.warning(
+            'Slow query, %.1f ms in %s %s:\n  %s\n  parameters: %r\n'
+            '  plan:\n%s',
+            seconds * 1000, request.method, request.path,
+            ' '.join(sql.split()), parameters,
+            '\n'.join(f'    {step}' for step in plan),
+        )
 
 
 def init_db():
     db = get_db()
 
-    with current_app.open_resource('schema.sql') as f:
+    with current_app.open_resource(get_backend().schema) as f:
         db.executescript(f.read().decode('utf8'))
 
+    migrate()
+
+
+def get_migrations():
+    """Return ``(version, filename)`` of every bundled migration in order.
+
+    Migrations live in the backend's ``migrations/`` folder as
+    ``<version>_<name>.sql``.
+    """
+    folder = os.path.join(current_app.root_path, get_backend().migrations)
+    return sorted(
+        (int(filename.split('_', 1)[0]), filename)
+        for filename in os.listdir(folder)
+        if filename.endswith('.sql')
+    )
+
+
+def get_schema_version():
+    return get_backend().get_schema_version(get_db())
+
+
+def migrate():
+    """Apply pending migrations, each in its own transaction.
+
+    Returns the filenames of the applied migrations.
+    """
+    backend = get_backend()
+    db = get_db()
+    current = get_schema_version()
+    applied = []
+
+    for version, filename in get_migrations():
+        if version <= current:
+            continue
+        path = f'{backend.migrations}/{filename}'
+        with current_app.open_resource(path) as f:
+            backend.run_migration(db, f.read().decode('utf8'), version)
+        applied.append(filename)
+
+    return applied
+
+
+def recount(fix=True):
+    """Find posts whose stored like and comment counts have drifted.
+
+    Returns the ids of those posts, recomputing their counters first
+    unless *fix* is false.
+    """
+    db = get_db()
+    stale = [row['id'] for row in db.execute('''
+        SELECT id FROM post
+        WHERE like_count !=
+            (SELECT COUNT(*) FROM reaction WHERE post_id = post.id)
+        OR comment_count !=
+            (SELECT COUNT(*) FROM comment WHERE post_id = post.id)'''
+    )]
+
+    if fix and stale:
+        db.execute('''
+            UPDATE post SET
+              like_count =
+                (SELECT COUNT(*) FROM reaction WHERE post_id = post.id),
+              comment_count =
+                (SELECT COUNT(*) FROM comment WHERE post_id = post.id)
+            WHERE id IN (%s)''' % ', '.join('?' * len(stale)),
+            stale
+        )
+        db.commit()
+
+    return stale
+
 
 @click.command('init-db')
 def init_db_command():
@@ -36,6 +186,180 @@ def init_db_command():
     click.echo('Initialized the database.')
 
 
+@click.command('migrate')
+@with_appcontext
+def migrate_command():
+    """Bring an existing database up to the current schema."""
+    applied = migrate()
+    for filename in applied:
+        click.echo(f'Applied {filename}.')
+    click.echo(f'Database is at version {get_schema_version()}.')
+
+
+@click.command('recount')
+@click.option('--check', is_flag=True, help='Only report stale counters.')
+@with_appcontext
+def recount_command(check):
+    """Verify and backfill the like and comment counters of posts."""
+    stale = recount(fix=not check)
+    if not stale:
+        click.echo('All counters are correct.')
+    else:
+        ids = ', '.join(map(str, stale))
+        if check:
+            click.echo(f'Stale counters for posts: {ids}.')
+        else:
+            click.echo(f'Recounted posts: {ids}.')
+
+
+class DryRunConnection(TimedConnection):
+    """A recorded connection whose changes are never committed."""
+
+    def commit(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def get_sample_requests():
+    """Return ``(method, path, data)`` requests to the main pages and
+    writes, about data in the database, and the user to send them as."""
+    from flaskr.blog import make_cursor
+
+    db = get_db()
+    post = db.execute('''
+        SELECT p.id, p.title, p.created, p.author_id, u.username
+        FROM post p JOIN "user" u ON p.author_id = u.id
+        WHERE p.id NOT IN (SELECT post_id FROM post_image)
+        ORDER BY p.id DESC LIMIT 1'''
+    ).fetchone()
+    if post is None:
+        raise click.ClickException(
+            'Queries are checked with the posts in the database, add one.'
+        )
+    tag = db.execute(
+        'SELECT name FROM tag ORDER BY post_count DESC LIMIT 1'
+    ).fetchone()
+    image = db.execute(
+        'SELECT post_id, ext FROM post_image LIMIT 1'
+    ).fetchone()
+
+    id = post['id']
+    word = (post['title'].split() or ['post'])[0]
+    cursor = make_cursor(post)
+    requests = [
+        ('GET', '/', None),
+        ('GET', f'/?after={cursor}&page=2', None),
+        ('GET', f'/?before={cursor}&page=2', None),
+        ('GET', f'/?search={word}', None),
+        ('GET', f'/{id}', None),
+        ('GET', '/tags', None),
+        ('GET', '/rss.xml', None),
+        ('GET', f"/author/{post['username']}/atom.xml", None),
+        ('POST', f'/{id}/like', {}),
+        ('POST', f'/{id}/comment', {'body': 'comment'}),
+        ('POST', '/create', {
+            'title': 'title', 'body': 'body', 'tags': 'tag',
+            'image': (BytesIO(), ''),
+        }),
+        ('POST', f'/{id}/update', {
+            'title': 'title', 'body': 'body', 'tags': 'tag',
+            'image': (BytesIO(), ''),
+        }),
+        ('POST', f'/{id}/delete', {}),
+    ]
+    if tag is not None:
+        requests += [
+            ('GET', f"/tag/{tag['name']}", None),
+            ('GET', f"/tag/{tag['name']}/rss.xml", None),
+        ]
+    if image is not None:
+        requests.append(
+            ('GET', f"/{image['post_id']}/image{image['ext']}", None)
+        )
+    return requests, {'id': post['author_id'], 'username': post['username']}
+
+
+# statements whose whole reads and sorts are the point: search ranks every
+# match, tag pages and feeds sort the posts of one tag, the tag cloud lists
+# every tag
+EXPECTED_SLOW = (
+    'ORDER BY bm25(',
+    'ORDER BY ts_rank(',
+    'WHERE pt.tag = ?',
+    'FROM tag ORDER BY post_count DESC',
+)
+
+
+@click.command('check-queries')
+@click.option('--all', 'show_all', is_flag=True,
+              help='Show the plan of every statement.')
+@with_appcontext
+def check_queries_command(show_all):
+    """Explain the statements of the main pages and writes.
+
+    The pages are requested as their author, the writes are rolled back.
+    Exits with status 1 when a statement scans a table, sorts in a temp
+    B-tree or needs an automatic index, unless it is one of
+    ``EXPECTED_SLOW``.
+    """
+    app = current_app._get_current_object()
+    # every statement must reach the database, right away
+    app.config.update(PAGE_CACHE=None, WRITE_QUEUE=False)
+    requests, user = get_sample_requests()
+    backend = get_backend()
+
+    # requests share the app context of the command, so these connections
+    # are the ones the views get
+    queries = g.queries = []
+    close_db()
+    g.db = DryRunConnection(backend.acquire(), queries)
+    g.read_db = TimedConnection(backend.acquire(read_only=True), queries)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user['id']
+        session['username'] = user['username']
+    for method, path, data in requests:
+        client.open(path, method=method, data=data)
+    g.db.rollback()
+
+    statements = {}
+    for sql, parameters, _ in queries:
+        if parameters is not None:
+            statements.setdefault(' '.join(sql.split()), parameters)
+    slow = expected = 0
+    for sql, parameters in statements.items():
+        plan = explain(g.db, sql, parameters)
+        steps = backend.slow_steps(plan)
+        known = any(pattern in sql for pattern in EXPECTED_SLOW)
+        if steps and known:
+            expected += 1
+        else:
+            slow += bool(steps)
+        if steps and not known or show_all:
+            click.echo(sql)
+            for step in plan:
+                mark = ' ' if step not in steps else '~' if known else '!'
+                click.echo(f'  {mark} {step}')
+            click.echo()
+    click.echo(
+        f'Checked {len(statements)} statements, {slow} scan a table, '
+        f'sort or build an index, {expected} more as expected.'
+    )
+    if slow:
+        raise SystemExit(1)
+
+
 def init_app(app):
+    app.before_request(start_query_log)
+    app.teardown_request(log_slow_queries)
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_command)
+    app.cli.add_command(recount_command)
+    app.cli.add_command(check_queries_command)
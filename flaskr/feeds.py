@@ -0,0 +1,170 @@
+"""RSS and Atom feeds, rendered when posts change instead of when polled.
+
+Every feed is stored as a ready-made document in the ``feed`` table,
+named like ``rss``, ``atom:tag:<tag>`` or ``rss:author:<user id>``. The
+site feeds are rendered on every post write; tag and author feeds are
+rendered on their first request and then rendered again by the writes
+of the posts they list.
+"""
+from datetime import datetime, timezone
+from hashlib import sha1
+import logging
+
+import click
+from flask import current_app, render_template
+from flask.cli import with_appcontext
+
+from flaskr.db import get_backend, get_db
+
+FORMATS = {
+    'rss': 'application/rss+xml',
+    'atom': 'application/atom+xml',
+}
+POSTS_PER_FEED = 20
+
+logger = logging.getLogger(__name__)
+
+
+def feed_name(format, scope=None):
+    return f'{format}:{scope}' if scope else format
+
+
+def select_feed_posts(scope):
+    """Return the newest posts for a feed scope, like ``tag:<tag>``."""
+    source = 'post p JOIN "user" u ON p.author_id = u.id'
+    where = ''
+    values = ()
+    kind, _, value = (scope or '').partition(':')
+    if kind == 'tag':
+        source += ' JOIN post_tag pt ON pt.post_id = p.id'
+        where = 'WHERE pt.tag = ?'
+        values = (value,)
+    elif kind == 'author':
+        where = 'WHERE p.author_id = ?'
+        values = (int(value),)
+    return get_db().execute(f'''
+        SELECT p.id, p.title, p.body, p.body_text, p.created, p.modified,
+               u.username
+        FROM {source}
+        {where}
+        ORDER BY p.created DESC
+        LIMIT ?''',
+        values + (POSTS_PER_FEED,)
+    ).fetchall()
+
+
+def feed_base_url():
+    """Return the root of feed links, from ``FEED_BASE_URL`` or else
+    ``SERVER_NAME``, or None if neither is set.
+
+    Stored feeds are served to everyone, so they are never built from the
+    address of the request that happens to render them.
+    """
+    config = current_app.config
+    if config['FEED_BASE_URL'] is not None:
+        return config['FEED_BASE_URL']
+    if config['SERVER_NAME'] is None:
+        return None
+    root = (config['APPLICATION_ROOT'] or '/').strip('/')
+    return (
+        f"{config['PREFERRED_URL_SCHEME']}://{config['SERVER_NAME']}/"
+        + (f'{root}/' if root else '')
+    )
+
+
+def render_feed(format, scope, title):
+    """Render a feed with absolute links under :func:`feed_base_url`, or
+    with links relative to the site root if it is unknown."""
+    base_url = feed_base_url()
+    if base_url is None:
+        logger.warning(
+            'Feeds link to posts by path, set FEED_BASE_URL or SERVER_NAME'
+            ' to the public address of the site for absolute links.'
+        )
+    posts = select_feed_posts(scope)
+    updated = max(
+        (post['modified'] or post['created'] for post in posts),
+        default=datetime.now(timezone.utc).replace(
+            tzinfo=None, microsecond=0
+        ),
+    )
+    with current_app.test_request_context(base_url=base_url):
+        return render_template(
+            f'{format}.xml.jinja', posts=posts, title=title, updated=updated,
+            external=base_url is not None,
+        ).encode('utf8'), updated
+
+
+def save_feed(name, title):
+    format, _, scope = name.partition(':')
+    body, updated = render_feed(format, scope, title)
+    etag = sha1(body).hexdigest()[:16]
+    get_db().execute('''
+        INSERT INTO feed (name, title, body, etag, updated)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET
+          title = excluded.title, body = excluded.body,
+          etag = excluded.etag, updated = excluded.updated''',
+        (name, title, body, etag, updated.strftime('%Y-%m-%d %H:%M:%S'))
+    )
+
+
+def get_feed(name, get_title):
+    """Return the stored feed *name*, rendering it first if there is none.
+
+    *get_title* returns the title of a new feed, or None if there is no
+    such feed. The caller commits.
+    """
+    db = get_db()
+    feed = db.execute(
+        'SELECT body, etag, updated FROM feed WHERE name = ?', (name,)
+    ).fetchone()
+    if feed is None:
+        title = get_title()
+        if title is None:
+            return None
+        # post writes wait until the feed is stored, or their
+        # refresh_feeds would miss it and leave it stale
+        get_backend().begin_write(db)
+        save_feed(name, title)
+        feed = db.execute(
+            'SELECT body, etag, updated FROM feed WHERE name = ?', (name,)
+        ).fetchone()
+    return feed
+
+
+def refresh_feeds(tags=(), author_ids=()):
+    """Render again the feeds that can list posts with *tags* or authors.
+
+    Call it in the transaction of the post write.
+    """
+    scopes = [f'tag:{tag}' for tag in tags] \
+        + [f'author:{id}' for id in author_ids]
+    names = [
+        feed_name(format, scope) for format in FORMATS for scope in scopes
+    ]
+    stored = dict(get_db().execute(
+        'SELECT name, title FROM feed WHERE name IN (%s)'
+        % ', '.join('?' * len(names)),
+        names
+    ).fetchall()) if names else {}
+    for format in FORMATS:
+        save_feed(format, 'Flaskr')
+    for name, title in stored.items():
+        save_feed(name, title)
+
+
+@click.command('refresh-feeds')
+@with_appcontext
+def refresh_feeds_command():
+    """Render every stored feed again, after posts changed in the database."""
+    db = get_db()
+    feeds = db.execute('SELECT name, title FROM feed').fetchall()
+    for feed in feeds:
+        save_feed(feed['name'], feed['title'])
+    db.commit()
+    click.echo(f'Refreshed {len(feeds)} feeds.')
+
+
+def init_app(app):
+    app.cli.add_command(refresh_feeds_command)
@@ -0,0 +1,466 @@
+"""Storage of the images attached to posts.
+
+The file name, size and pixel dimensions of every image are recorded in
+``post_image`` at upload time, so pages never have to look at the image
+folder to find out whether a post has an image.
+
+With Pillow installed, downscaled variants (``IMAGE_VARIANTS``) and WebP
+versions of them are generated in a worker pool after each upload and
+stored next to the original as ``<id>.<variant><ext>``. Once they are
+made their names are recorded in ``post_image``, and only then do pages
+link to them.
+
+The files of a post live in a two-level directory picked by a hash of its
+id, like ``3f/a2/<id><ext>``, so no directory grows past a few hundred
+entries however many posts there are.
+
+Image URLs carry a hash of the original, so they can be cached forever.
+
+Uploads are copied in chunks to a temporary file next to the images and
+renamed into place, and their format is told by their first bytes rather
+than by the file name.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import functools
+from hashlib import sha1, sha256
+from pathlib import Path
+import os
+import struct
+import tempfile
+
+import click
+from flask import current_app, url_for
+from flask.cli import with_appcontext
+
+from flaskr.cache import invalidate
+from flaskr.db import get_db
+
+ALLOWED_EXTENSIONS = {'.jpe', '.jpg', '.jpeg', '.gif', '.png', '.bmp', '.webp'}
+SIGNATURES = (
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+    (b'BM', '.bmp'),
+)
+CHUNK_SIZE = 64 * 1024
+
+
+def sniff_image(head):
+    """Return the extension for the format of a file starting with *head*."""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return '.webp'
+    for signature, ext in SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    return None
+
+
+def image_folder():
+    return Path(
+        current_app.instance_path,
+        current_app.config['POST_IMAGE_FOLDER']
+    )
+
+
+def shard_dir(id):
+    digest = sha1(str(id).encode()).hexdigest()
+    return os.path.join(digest[:2], digest[2:4])
+
+
+def image_path(id, ext):
+    return Path(image_folder(), shard_dir(id), f'{id}{ext}')
+
+
+def hash_file(path):
+    digest = sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(64 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def image_url(id, ext, digest, size=None):
+    if digest is None:
+        return url_for('blog.get_legacy_image', id=id, ext=ext[1:], size=size)
+    return url_for(
+        'blog.get_image', id=id, digest=digest, ext=ext[1:].lower(), size=size
+    )
+
+
+def get_image_record(id):
+    return get_db().execute(
+        'SELECT ext, digest FROM post_image WHERE post_id = ?', (id,)
+    ).fetchone()
+
+
+def store_digest(id, ext):
+    """Hash an image recorded before digests were; the caller commits."""
+    digest = hash_file(image_path(id, ext))
+    get_db().execute(
+        'UPDATE post_image SET digest = ? WHERE post_id = ?', (digest, id)
+    )
+    return digest
+
+
+def variant_path(path, variant, ext=None):
+    return path.with_name(f'{path.stem}.{variant}{ext or path.suffix}')
+
+
+def fit_size(width, height, bound):
+    scale = min(1, bound / max(width, height))
+    return round(width * scale), round(height * scale)
+
+
+def variant_sizes(width, height):
+    """Return the expected pixel size of every variant of an image."""
+    if not width or not height:
+        return {}
+    return {
+        variant: fit_size(width, height, bound)
+        for variant, bound in current_app.config['IMAGE_VARIANTS'].items()
+    }
+
+
+def select_variant(id, ext, variant=None, webp=False):
+    """Return the path to serve, relative to the image folder, and whether
+    it is the one asked for.
+
+    Falls back to the original while the variants are still being made,
+    or when they can't be made at all.
+    """
+    path = image_path(id, ext)
+    if variant in current_app.config['IMAGE_VARIANTS']:
+        suffixes = ('.webp', ext) if webp else (ext,)
+        for suffix in suffixes:
+            candidate = variant_path(path, variant, suffix)
+            if candidate.exists():
+                return (
+                    os.path.join(shard_dir(id), candidate.name),
+                    suffix == suffixes[0],
+                )
+    return os.path.join(shard_dir(id), path.name), not variant
+
+
+@functools.lru_cache(maxsize=None)
+def import_pil():
+    """Return PIL's Image module, imported with the first upload since it
+    is slow to load, or None without Pillow."""
+    try:
+        from PIL import Image
+    except ImportError:  # variants are optional, originals are always served
+        return None
+    return Image
+
+
+def _save_atomically(image, path, format, **params):
+    tmp = path.with_name(path.name + '.tmp')
+    image.save(tmp, format, **params)
+    os.replace(tmp, path)
+
+
+def make_variants(path, variants, quality):
+    """Write the downscaled and WebP variants of the image at *path*.
+
+    Runs in the worker pool, so it must not use the app or request.
+    """
+    with import_pil().open(path) as original:
+        format = original.format
+        image = original.convert(
+            'RGBA' if 'A' in original.getbands()
+            or 'transparency' in original.info else 'RGB'
+        )
+
+    for variant, bound in variants.items():
+        resized = image.copy()
+        resized.thumbnail((bound, bound))
+        _save_atomically(
+            resized.convert('RGB') if format == 'JPEG' else resized,
+            variant_path(path, variant), format,
+        )
+        _save_atomically(
+            resized, variant_path(path, variant, '.webp'), 'WEBP',
+            quality=quality,
+        )
+
+
+def get_executor():
+    extensions = current_app.extensions
+    if 'image_executor' not in extensions:
+        extensions['image_executor'] = ThreadPoolExecutor(
+            current_app.config['IMAGE_WORKERS'],
+            thread_name_prefix='flaskr-images',
+        )
+    return extensions['image_executor']
+
+
+def record_variants(id, variants):
+    """Record that the variants of the image of post *id* are made; the
+    caller commits."""
+    db = get_db()
+    db.execute(
+        'UPDATE post_image SET variants = ? WHERE post_id = ?',
+        (' '.join(variants), id)
+    )
+    # a new version, so that conditional requests get the page with them
+    db.execute('UPDATE post SET version = version + 1 WHERE id = ?', (id,))
+
+
+def schedule_variants(id):
+    """Make and record the variants of the image of post *id* in the pool,
+    if it has workers. Call it once the image is committed."""
+    Image = import_pil()
+    if Image is None:
+        return
+
+    app = current_app._get_current_object()
+    image = get_image_record(id)
+    path = image_path(id, image['ext'])
+    variants = app.config['IMAGE_VARIANTS']
+    quality = app.config['IMAGE_WEBP_QUALITY']
+
+    def run():
+        try:
+            make_variants(path, variants, quality)
+        except (OSError, Image.DecompressionBombError) as e:
+            app.logger.warning('Could not make variants of %s: %s', path, e)
+            return
+        with app.app_context():
+            # unless the post got another image meanwhile
+            current = get_image_record(id)
+            if current is not None and current['digest'] == image['digest']:
+                record_variants(id, variants)
+                get_db().commit()
+                invalidate(f'post:{id}')
+
+    if app.config['IMAGE_WORKERS']:
+        get_executor().submit(run)
+    else:
+        run()
+
+
+def read_image_size(stream):
+    """Read ``(width, height)`` from the header of an image file.
+
+    Knows GIF, PNG, JPEG, BMP and WebP; returns None for anything else.
+    """
+    try:
+        head = stream.read(30)
+        if head[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', head[6:10])
+        if head[:8] == b'\x89PNG\r\n\x1a\n' and head[12:16] == b'IHDR':
+            return struct.unpack('>II', head[16:24])
+        if head[:2] == b'BM':
+            width, height = struct.unpack('<ii', head[18:26])
+            return width, abs(height)
+        if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+            return _read_webp_size(head)
+        if head[:2] == b'\xff\xd8':
+            stream.seek(2)
+            return _read_jpeg_size(stream)
+    except struct.error:
+        pass
+    return None
+
+
+def _read_webp_size(head):
+    chunk = head[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', head[26:30])
+        return width & 0x3fff, height & 0x3fff
+    if chunk == b'VP8L':
+        bits = int.from_bytes(head[21:25], 'little')
+        return (bits & 0x3fff) + 1, (bits >> 14 & 0x3fff) + 1
+    if chunk == b'VP8X':
+        return (
+            int.from_bytes(head[24:27], 'little') + 1,
+            int.from_bytes(head[27:30], 'little') + 1,
+        )
+    return None
+
+
+def _read_jpeg_size(stream):
+    # walk the segments up to the first start-of-frame marker
+    while True:
+        if stream.read(1) != b'\xff':
+            return None
+        marker = stream.read(1)
+        while marker == b'\xff':
+            marker = stream.read(1)
+        if not marker:
+            return None
+        if marker[0] == 0x01 or 0xd0 <= marker[0] <= 0xd8:
+            continue
+        length, = struct.unpack('>H', stream.read(2))
+        if 0xc0 <= marker[0] <= 0xcf and marker[0] not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>xHH', stream.read(5))
+            return width, height
+        stream.seek(length - 2, os.SEEK_CUR)
+
+
+def record_image(id, path):
+    with open(path, 'rb') as f:
+        width, height = read_image_size(f) or (None, None)
+    get_db().execute('''
+        INSERT INTO post_image (post_id, ext, size, width, height, digest)
+        VALUES (?, ?, ?, ?, ?, ?)''',
+        (id, path.suffix, path.stat().st_size, width, height, hash_file(path))
+    )
+
+
+def receive_image(file):
+    """Copy an uploaded image to a temporary file in the image folder.
+
+    Returns the path of the copy and the extension of its format, or
+    raises ValueError with a message for the user.
+    """
+    limit = current_app.config['IMAGE_MAX_SIZE']
+    head = file.stream.read(32)
+    ext = sniff_image(head)
+    if ext is None:
+        raise ValueError('Invalid image file type.')
+
+    fd, tmp = tempfile.mkstemp(suffix='.part', dir=image_folder())
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(head)
+            size = len(head)
+            while chunk := file.stream.read(CHUNK_SIZE):
+                size += len(chunk)
+                if limit is not None and size > limit:
+                    raise ValueError(
+                        f'Image is larger than {limit // 1024} KiB.'
+                    )
+                f.write(chunk)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return Path(tmp), ext
+
+
+def save_image(id, upload):
+    """Move a file from receive_image into place; the caller commits and
+    then calls :func:`schedule_variants`."""
+    tmp, ext = upload
+    path = image_path(id, ext)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp, path)
+    record_image(id, path)
+
+
+def remove_image(id):
+    """Delete the image of post *id*, if any; the caller commits."""
+    db = get_db()
+    image = db.execute(
+        'SELECT ext FROM post_image WHERE post_id = ?', (id,)
+    ).fetchone()
+    if image is not None:
+        path = image_path(id, image['ext'])
+        path.unlink(missing_ok=True)
+        for variant in current_app.config['IMAGE_VARIANTS']:
+            variant_path(path, variant).unlink(missing_ok=True)
+            variant_path(path, variant, '.webp').unlink(missing_ok=True)
+        db.execute('DELETE FROM post_image WHERE post_id = ?', (id,))
+
+
+@click.command('scan-images')
+@with_appcontext
+def scan_images_command():
+    """Record images uploaded before their metadata was stored."""
+    db = get_db()
+    unhashed = db.execute(
+        'SELECT post_id, ext FROM post_image WHERE digest IS NULL'
+    ).fetchall()
+    for image in unhashed:
+        store_digest(image['post_id'], image['ext'])
+
+    posts = {row['id'] for row in db.execute('SELECT id FROM post')}
+    known = {
+        row['post_id'] for row in db.execute('SELECT post_id FROM post_image')
+    }
+    count = 0
+
+    for dirpath, _, filenames in os.walk(image_folder()):
+        for name in filenames:
+            stem, ext = os.path.splitext(name)
+            if not stem.isdigit() or ext.lower() not in ALLOWED_EXTENSIONS:
+                continue
+            id = int(stem)
+            path = Path(dirpath, name)
+            if id in posts and id not in known \
+                    and path == image_path(id, ext):
+                record_image(id, path)
+                known.add(id)
+                count += 1
+
+    db.commit()
+    click.echo(f'Recorded {count} images, hashed {len(unhashed)}.')
+
+
+@click.command('make-variants')
+@with_appcontext
+def make_variants_command():
+    """Make the variants of images uploaded before they were made, or
+    before IMAGE_VARIANTS changed."""
+    Image = import_pil()
+    if Image is None:
+        raise click.ClickException(
+            'Variants are made with Pillow, install flaskr[images].'
+        )
+    db = get_db()
+    variants = current_app.config['IMAGE_VARIANTS']
+    images = [
+        image for image in db.execute(
+            'SELECT post_id, ext, variants FROM post_image'
+        ).fetchall()
+        if set((image['variants'] or '').split()) != set(variants)
+    ]
+    count = 0
+
+    for image in images:
+        id = image['post_id']
+        path = image_path(id, image['ext'])
+        try:
+            make_variants(
+                path, variants, current_app.config['IMAGE_WEBP_QUALITY']
+            )
+        except (OSError, Image.DecompressionBombError) as e:
+            click.echo(f'Could not make variants of {path}: {e}', err=True)
+            continue
+        record_variants(id, variants)
+        db.commit()
+        invalidate(f'post:{id}')
+        count += 1
+
+    click.echo(f'Made the variants of {count} of {len(images)} images.')
+
+
+@click.command('shard-images')
+@with_appcontext
+def shard_images_command():
+    """Move images stored flat in the image folder into their shards."""
+    folder = image_folder()
+    count = 0
+
+    # entries are moved one at a time as the folder is read, so this
+    # runs in constant memory and can be interrupted and run again
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            id = entry.name.partition('.')[0]
+            ext = os.path.splitext(entry.name)[1].lower()
+            if not entry.is_file() or not id.isdigit() \
+                    or ext not in ALLOWED_EXTENSIONS:
+                continue
+            path = Path(folder, shard_dir(int(id)), entry.name)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(entry.path, path)
+            count += 1
+
+    click.echo(f'Moved {count} files.')
+
+
+def init_app(app):
+    app.cli.add_command(scan_images_command)
+    app.cli.add_command(make_variants_command)
+    app.cli.add_command(shard_images_command)
+    app.add_template_global(image_url)
@@ -0,0 +1,330 @@
+"""Opt-in measurements of what each request costs.
+
+With ``INSTRUMENTATION`` on, every request records the statements it runs
+with their time, and the time spent rendering templates and Markdown.
+The totals go out in a ``Server-Timing`` header and a JSON log line of
+the ``flaskr.metrics`` logger, with each statement logged at DEBUG. They
+are also added up per endpoint and served at ``/metrics`` in the
+Prometheus text format, with histograms of the request latencies.
+
+The numbers at ``/metrics`` are those of one worker process.
+"""
+from bisect import bisect_left
+from collections import Counter
+import json
+import logging
+import threading
+import time
+
+import jinja2
+from flask import current_app, g, has_app_context, request
+
+from flaskr.cache import get_cache
+
+logger = logging.getLogger(__name__)
+
+
+def add_time(name, seconds):
+    if has_app_context() and 'timings' in g:
+        g.timings[name] += seconds
+
+
+class TimedCursor:
+    """A cursor that adds the time of fetching rows to its statement."""
+
+    def __init__(self, cursor, record):
+        self._cursor = cursor
+        self._record = record
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._record[2] += time.perf_counter() - start
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedConnection:
+    """A database connection that records ``[sql, parameters, seconds]``
+    of the statements run on it in *queries*.
+
+    The parameters of :meth:`executemany` are those of its first row, and
+    None for scripts.
+    """
+
+    def __init__(self, connection, queries):
+        self._connection = connection
+        self._queries = queries
+
+    @property
+    def wrapped(self):
+        return self._connection
+
+    def _run(self, method, sql, parameters, *args):
+        record = [sql, parameters, 0.0]
+        self._queries.append(record)
+        start = time.perf_counter()
+        try:
+            result = method(sql, *args)
+        finally:
+            record[2] += time.perf_counter() - start
+        return TimedCursor(result, record)
+
+    def execute(self, sql, parameters=()):
+        return self._run(
+            self._connection.execute, sql, parameters, parameters
+        )
+
+    def executemany(self, sql, seq_of_parameters):
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            seq_of_parameters = list(seq_of_parameters)
+        first = seq_of_parameters[0] if seq_of_parameters else None
+        return self._run(
+            self._connection.executemany, sql, first, seq_of_parameters
+        )
+
+    def executescript(self, script):
+        return self._run(self._connection.executescript, script, None)
+
+    def __enter__(self):
+        self._connection.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._connection.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class TimedTemplate(jinja2.Template):
+    """A template that adds its render time to the request's."""
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            add_time('render', time.perf_counter() - start)
+
+
+def timed_filter(name, filter):
+    def wrapped_filter(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return filter(*args, **kwargs)
+        finally:
+            add_time(name, time.perf_counter() - start)
+
+    return wrapped_filter
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+def label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"')
+
+
+class Metrics:
+    """Request counts and times of one process, per endpoint."""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self.requests = Counter()
+        self.latencies = {}
+        self.queries = Counter()
+        self.seconds = Counter()
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, method, status, duration, timings, queries):
+        with self._lock:
+            self.requests[endpoint, method, status] += 1
+            if endpoint not in self.latencies:
+                self.latencies[endpoint] = Histogram(self.buckets)
+            self.latencies[endpoint].observe(duration)
+            self.queries[endpoint] += queries
+            for name, seconds in timings.items():
+                self.seconds[endpoint, name] += seconds
+
+    def render(self):
+        lines = [
+            '# HELP flaskr_requests_total Requests handled.',
+            '# TYPE flaskr_requests_total counter',
+        ]
+        with self._lock:
+            lines += (
+                f'flaskr_requests_total{{endpoint="{label(endpoint)}",'
+                f'method="{method}",status="{status}"}} {count}'
+                for (endpoint, method, status), count
+                in sorted(self.requests.items())
+            )
+            lines += [
+                '# HELP flaskr_request_duration_seconds Request latency.',
+                '# TYPE flaskr_request_duration_seconds histogram',
+            ]
+            for endpoint, histogram in sorted(self.latencies.items()):
+                lines += histogram.lines(
+                    'flaskr_request_duration_seconds',
+                    f'endpoint="{label(endpoint)}"'
+                )
+            lines += [
+                '# HELP flaskr_db_queries_total Statements run.',
+                '# TYPE flaskr_db_queries_total counter',
+            ]
+            lines += (
+                f'flaskr_db_queries_total{{endpoint="{label(endpoint)}"}} '
+                f'{count}'
+                for endpoint, count in sorted(self.queries.items())
+            )
+            for name, help in (
+                ('db', 'Time spent running statements.'),
+                ('render', 'Time spent rendering templates.'),
+                ('markdown', 'Time spent rendering Markdown.'),
+            ):
+                lines += [
+                    f'# HELP flaskr_{name}_seconds_total {help}',
+                    f'# TYPE flaskr_{name}_seconds_total counter',
+                ]
+                lines += (
+                    f'flaskr_{name}_seconds_total'
+                    f'{{endpoint="{label(endpoint)}"}} {seconds}'
+                    for (endpoint, kind), seconds
+                    in sorted(self.seconds.items())
+                    if kind == name
+                )
+
+        cache = get_cache()
+        if cache is not None:
+            stats = cache.stats()
+            lines += [
+                '# HELP flaskr_page_cache_requests_total Page cache lookups.',
+                '# TYPE flaskr_page_cache_requests_total counter',
+                'flaskr_page_cache_requests_total{result="hit"} '
+                f"{stats['hits']}",
+                'flaskr_page_cache_requests_total{result="miss"} '
+                f"{stats['misses']}",
+                '# HELP flaskr_page_cache_entries Entries in the page cache.',
+                '# TYPE flaskr_page_cache_entries gauge',
+                f"flaskr_page_cache_entries {stats['entries']}",
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+def get_metrics():
+    extensions = current_app.extensions
+    if 'metrics' not in extensions:
+        extensions['metrics'] = Metrics(current_app.config['METRICS_BUCKETS'])
+    return extensions['metrics']
+
+
+def start_request():
+    g.request_started = time.perf_counter()
+    g.timings = {'db': 0.0, 'render': 0.0, 'markdown': 0.0}
+    g.queries = []
+
+
+def finish_request(response):
+    if 'request_started' not in g:
+        return response
+    duration = time.perf_counter() - g.request_started
+    timings = g.timings
+    queries = g.queries
+    timings['db'] = sum((seconds for _, _, seconds in queries), 0.0)
+    endpoint = request.endpoint or 'unmatched'
+
+    response.headers['Server-Timing'] = ', '.join(
+        [f'db;dur={timings["db"] * 1000:.2f};desc="{len(queries)} queries"']
+        + [
+            f'{name};dur={timings[name] * 1000:.2f}'
+            for name in ('render', 'markdown')
+        ]
+        + [f'total;dur={duration * 1000:.2f}']
+    )
+    get_metrics().observe(
+        endpoint, request.method, response.status_code, duration, timings,
+        len(queries),
+    )
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'queries': len(queries),
+            **{
+                f'{name}_ms': round(seconds * 1000, 2)
+                for name, seconds in timings.items()
+            },
+        }))
+    if logger.isEnabledFor(logging.DEBUG):
+        for sql, _, seconds in queries:
+            logger.debug(json.dumps({
+                'path': request.path,
+                'sql': ' '.join(sql.split()),
+                'duration_ms': round(seconds * 1000, 3),
+            }))
+    return response
+
+
+def metrics_view():
+    return current_app.response_class(
+        get_metrics().render(),
+        mimetype='text/plain; version=0.0.4',
+    )
+
+
+def init_app(app):
+    """Instrument *app* if ``INSTRUMENTATION`` is on.
+
+    Call it after the Markdown filter is set up and before the other
+    request hooks are added, so that their time is counted too.
+    """
+    if not app.config['INSTRUMENTATION']:
+        return
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.jinja_env.template_class = TimedTemplate
+    filters = app.jinja_env.filters
+    filters['markdown'] = timed_filter('markdown', filters['markdown'])
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,26 @@
+-- Full-text index over post title, body and tags.
+
+CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(
+  title, body, tags,
+  content='post', content_rowid='id',
+  tokenize="unicode61 tokenchars '_'"
+);
+
+CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN
+  INSERT INTO post_fts (rowid, title, body, tags)
+  VALUES (new.id, new.title, new.body, new.tags);
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body, tags)
+  VALUES ('delete', old.id, old.title, old.body, old.tags);
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE OF title, body, tags ON post BEGIN
+  INSERT INTO post_fts (post_fts, rowid, title, body, tags)
+  VALUES ('delete', old.id, old.title, old.body, old.tags);
+  INSERT INTO post_fts (rowid, title, body, tags)
+  VALUES (new.id, new.title, new.body, new.tags);
+END;
+
+INSERT INTO post_fts (post_fts) VALUES ('rebuild');
@@ -0,0 +1,42 @@
+-- Normalized tags with per-tag post counts, filled from the space-joined
+-- post.tags column.
+
+CREATE TABLE IF NOT EXISTS tag (
+  name TEXT PRIMARY KEY,
+  post_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS post_tag (
+  tag TEXT NOT NULL,
+  post_id INTEGER NOT NULL,
+  PRIMARY KEY (tag, post_id),
+  FOREIGN KEY (post_id) REFERENCES post (id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS post_tag_post_id ON post_tag (post_id);
+
+CREATE TRIGGER IF NOT EXISTS post_tag_insert AFTER INSERT ON post_tag BEGIN
+  INSERT INTO tag (name, post_count) VALUES (new.tag, 1)
+  ON CONFLICT (name) DO UPDATE SET post_count = post_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_tag_delete AFTER DELETE ON post_tag BEGIN
+  UPDATE tag SET post_count = post_count - 1 WHERE name = old.tag;
+  DELETE FROM tag WHERE name = old.tag AND post_count <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_delete_tags AFTER DELETE ON post BEGIN
+  DELETE FROM post_tag WHERE post_id = old.id;
+END;
+
+WITH RECURSIVE split (post_id, tag, rest) AS (
+  SELECT id, '', tags || ' ' FROM post
+  UNION ALL
+  SELECT
+    post_id,
+    substr(rest, 1, instr(rest, ' ') - 1),
+    substr(rest, instr(rest, ' ') + 1)
+  FROM split WHERE rest <> ''
+)
+INSERT OR IGNORE INTO post_tag (tag, post_id)
+SELECT tag, post_id FROM split WHERE tag <> '';
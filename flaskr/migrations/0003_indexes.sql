@@ -0,0 +1,12 @@
+-- Secondary indexes for the index page, reactions and comments, and
+-- one reaction per user and post.
+
+CREATE INDEX IF NOT EXISTS post_created ON post (created);
+CREATE INDEX IF NOT EXISTS post_author_id ON post (author_id);
+CREATE INDEX IF NOT EXISTS comment_post_id_created ON comment (post_id, created);
+
+DELETE FROM reaction WHERE rowid NOT IN (
+  SELECT MIN(rowid) FROM reaction GROUP BY post_id, user_id
+);
+CREATE UNIQUE INDEX IF NOT EXISTS reaction_post_id_user_id
+ON reaction (post_id, user_id);
@@ -0,0 +1,24 @@
+-- Like and comment counts stored on post and kept current by triggers.
+
+ALTER TABLE post ADD COLUMN like_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE post ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0;
+
+CREATE TRIGGER reaction_insert_count AFTER INSERT ON reaction BEGIN
+  UPDATE post SET like_count = like_count + 1 WHERE id = new.post_id;
+END;
+
+CREATE TRIGGER reaction_delete_count AFTER DELETE ON reaction BEGIN
+  UPDATE post SET like_count = like_count - 1 WHERE id = old.post_id;
+END;
+
+CREATE TRIGGER comment_insert_count AFTER INSERT ON comment BEGIN
+  UPDATE post SET comment_count = comment_count + 1 WHERE id = new.post_id;
+END;
+
+CREATE TRIGGER comment_delete_count AFTER DELETE ON comment BEGIN
+  UPDATE post SET comment_count = comment_count - 1 WHERE id = old.post_id;
+END;
+
+UPDATE post SET
+  like_count = (SELECT COUNT(*) FROM reaction WHERE post_id = post.id),
+  comment_count = (SELECT COUNT(*) FROM comment WHERE post_id = post.id);
@@ -0,0 +1,7 @@
+-- Markdown rendered at write time: HTML, plain text for excerpts and feeds,
+-- and a hash of the source body it was rendered from. Existing posts are
+-- filled in by `flask render-posts`.
+
+ALTER TABLE post ADD COLUMN body_html TEXT;
+ALTER TABLE post ADD COLUMN body_text TEXT;
+ALTER TABLE post ADD COLUMN body_hash TEXT;
@@ -0,0 +1,30 @@
+-- Content versions for conditional requests: a version and modification
+-- time per post, bumped whenever the post, its tags, likes or comments
+-- change, and one for the whole site, bumped on any post change.
+
+ALTER TABLE post ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE post ADD COLUMN modified TIMESTAMP;
+
+CREATE TABLE revision (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  version INTEGER NOT NULL DEFAULT 0,
+  modified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO revision (id) VALUES (1);
+
+CREATE TRIGGER post_insert_revision AFTER INSERT ON post BEGIN
+  UPDATE revision SET version = version + 1, modified = CURRENT_TIMESTAMP;
+END;
+
+-- counter triggers update post too, so likes and comments land here
+CREATE TRIGGER post_update_revision AFTER UPDATE ON post
+WHEN new.version = old.version BEGIN
+  UPDATE post SET version = version + 1, modified = CURRENT_TIMESTAMP
+  WHERE id = new.id;
+  UPDATE revision SET version = version + 1, modified = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER post_delete_revision AFTER DELETE ON post BEGIN
+  UPDATE revision SET version = version + 1, modified = CURRENT_TIMESTAMP;
+END;
@@ -0,0 +1,11 @@
+-- Metadata of post images, so pages don't have to scan the image folder.
+-- Files uploaded before this are recorded by `flask scan-images`.
+
+CREATE TABLE post_image (
+  post_id INTEGER PRIMARY KEY,
+  ext TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  width INTEGER,
+  height INTEGER,
+  FOREIGN KEY (post_id) REFERENCES post (id)
+);
@@ -0,0 +1,4 @@
+-- Content hash of post images for immutable, cache-busting image URLs.
+-- Filled in on first request of an image or by `flask scan-images`.
+
+ALTER TABLE post_image ADD COLUMN digest TEXT;
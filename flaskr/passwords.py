@@ -0,0 +1,140 @@
+"""Password hashing off the request threads, and login rate limits.
+
+Hashes are computed by a small pool of threads, ``PASSWORD_HASH_WORKERS``,
+so a burst of logins keeps at most that many cores busy and the other
+routes keep their share. Requests that would wait longer than
+``PASSWORD_HASH_TIMEOUT`` for a free worker are refused.
+
+Login attempts are limited per client address and per username with
+token buckets: ``LOGIN_RATE_LIMIT = (burst, seconds)`` allows *burst*
+attempts at once and one more every ``seconds / burst``.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import threading
+import time
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashPool:
+    """A thread pool for password hashes that refuses work when busy."""
+
+    def __init__(self, workers, timeout):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            workers, thread_name_prefix='flaskr-passwords'
+        )
+        # one running and one waiting hash per worker at most
+        self._slots = threading.BoundedSemaphore(workers * 2)
+
+    def run(self, function, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise ServiceUnavailable('The server is busy, try again later.')
+        try:
+            return self._executor.submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+
+def get_hash_pool():
+    extensions = current_app.extensions
+    if 'hash_pool' not in extensions:
+        extensions['hash_pool'] = HashPool(
+            current_app.config['PASSWORD_HASH_WORKERS'],
+            current_app.config['PASSWORD_HASH_TIMEOUT'],
+        )
+    return extensions['hash_pool']
+
+
+def hash_password(password):
+    method = current_app.config['PASSWORD_HASH_METHOD']
+    return get_hash_pool().run(generate_password_hash, password, method)
+
+
+def check_password(pwhash, password):
+    return get_hash_pool().run(check_password_hash, pwhash, password)
+
+
+@functools.lru_cache(maxsize=None)
+def hash_prefix(method):
+    """Return the method as written in hashes made with *method*.
+
+    Werkzeug fills in the parameters left out, like the iterations of
+    ``pbkdf2:sha256``, so the prefix is taken from an actual hash.
+    """
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+def needs_rehash(pwhash):
+    """Tell whether *pwhash* was made with other than the current method."""
+    method = pwhash.split('$', 1)[0]
+    return method != hash_prefix(current_app.config['PASSWORD_HASH_METHOD'])
+
+
+class RateLimiter:
+    """Token buckets, one per key, that fill up at a steady rate."""
+
+    def __init__(self, burst, period, max_keys=10000):
+        self.burst = burst
+        self.rate = burst / period
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _level(self, bucket, now):
+        tokens, updated = bucket
+        return min(self.burst, tokens + (now - updated) * self.rate)
+
+    def hit(self, key):
+        """Take a token for *key*; return the seconds to wait if none left."""
+        now = time.monotonic()
+        with self._lock:
+            if key not in self._buckets and \
+                    len(self._buckets) >= self.max_keys:
+                self._prune(now)
+            bucket = self._buckets.get(key)
+            tokens = self.burst if bucket is None else self._level(bucket, now)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1, now)
+            return 0
+
+    def _prune(self, now):
+        # full buckets are the same as no bucket at all
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if self._level(bucket, now) < self.burst
+        }
+        if len(self._buckets) >= self.max_keys:
+            # too many keys still, forget the least recently hit ones
+            keep = sorted(
+                self._buckets.items(), key=lambda item: item[1][1]
+            )[-(self.max_keys * 3 // 4):]
+            self._buckets = dict(keep)
+
+
+def get_login_limiter():
+    extensions = current_app.extensions
+    if 'login_limiter' not in extensions:
+        burst, period = current_app.config['LOGIN_RATE_LIMIT']
+        extensions['login_limiter'] = RateLimiter(burst, period)
+    return extensions['login_limiter']
+
+
+def limit_login(remote_addr, username):
+    """Count a login attempt, raising 429 when there were too many."""
+    if current_app.config['LOGIN_RATE_LIMIT'] is None:
+        return
+    limiter = get_login_limiter()
+    wait = max(
+        limiter.hit(f'addr:{remote_addr}'), limiter.hit(f'user:{username}')
+    )
+    if wait:
+        raise TooManyRequests(
+            'Too many login attempts, try again later.',
+            retry_after=int(wait) + 1,
+        )
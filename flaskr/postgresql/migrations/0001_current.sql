@@ -0,0 +1,116 @@
+-- Everything the SQLite migrations up to 0008 add, in one step: search,
+-- tags, indexes, counters, rendered bodies, revisions and post images.
+-- There are no older PostgreSQL databases, so nothing is backfilled.
+
+ALTER TABLE post
+  ADD COLUMN like_count INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN body_html TEXT,
+  ADD COLUMN body_text TEXT,
+  ADD COLUMN body_hash TEXT,
+  ADD COLUMN version INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN modified TIMESTAMP(0),
+  -- weighted like the bm25() ranking of the SQLite full-text index
+  ADD COLUMN search tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', title), 'A')
+    || setweight(to_tsvector('simple', tags), 'B')
+    || setweight(to_tsvector('simple', body), 'D')
+  ) STORED;
+
+CREATE INDEX post_search ON post USING GIN (search);
+CREATE INDEX post_created ON post (created);
+CREATE INDEX post_author_id ON post (author_id);
+CREATE INDEX comment_post_id_created ON comment (post_id, created);
+CREATE UNIQUE INDEX reaction_post_id_user_id ON reaction (post_id, user_id);
+
+CREATE TABLE tag (
+  name TEXT PRIMARY KEY,
+  post_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE post_tag (
+  tag TEXT NOT NULL,
+  post_id INTEGER NOT NULL REFERENCES post (id) ON DELETE CASCADE,
+  PRIMARY KEY (tag, post_id)
+);
+
+CREATE INDEX post_tag_post_id ON post_tag (post_id);
+
+CREATE TABLE revision (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  version INTEGER NOT NULL DEFAULT 0,
+  modified TIMESTAMP(0) NOT NULL DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+INSERT INTO revision (id) VALUES (1);
+
+CREATE TABLE post_image (
+  post_id INTEGER PRIMARY KEY REFERENCES post (id) ON DELETE CASCADE,
+  ext TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  width INTEGER,
+  height INTEGER,
+  digest TEXT
+);
+
+CREATE FUNCTION post_tag_count() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    INSERT INTO tag (name, post_count) VALUES (NEW.tag, 1)
+    ON CONFLICT (name) DO UPDATE SET post_count = tag.post_count + 1;
+  ELSE
+    UPDATE tag SET post_count = post_count - 1 WHERE name = OLD.tag;
+    DELETE FROM tag WHERE name = OLD.tag AND post_count <= 0;
+  END IF;
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE TRIGGER post_tag_count AFTER INSERT OR DELETE ON post_tag
+FOR EACH ROW EXECUTE FUNCTION post_tag_count();
+
+CREATE FUNCTION reaction_count() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    UPDATE post SET like_count = like_count + 1 WHERE id = NEW.post_id;
+  ELSE
+    UPDATE post SET like_count = like_count - 1 WHERE id = OLD.post_id;
+  END IF;
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE TRIGGER reaction_count AFTER INSERT OR DELETE ON reaction
+FOR EACH ROW EXECUTE FUNCTION reaction_count();
+
+CREATE FUNCTION comment_count() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    UPDATE post SET comment_count = comment_count + 1 WHERE id = NEW.post_id;
+  ELSE
+    UPDATE post SET comment_count = comment_count - 1 WHERE id = OLD.post_id;
+  END IF;
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE TRIGGER comment_count AFTER INSERT OR DELETE ON comment
+FOR EACH ROW EXECUTE FUNCTION comment_count();
+
+-- counter triggers update post too, so likes and comments land here
+CREATE FUNCTION post_version() RETURNS trigger AS $$
+BEGIN
+  NEW.version = OLD.version + 1;
+  NEW.modified = now() AT TIME ZONE 'utc';
+  RETURN NEW;
+END $$ LANGUAGE plpgsql;
+
+CREATE TRIGGER post_version BEFORE UPDATE ON post
+FOR EACH ROW EXECUTE FUNCTION post_version();
+
+CREATE FUNCTION site_revision() RETURNS trigger AS $$
+BEGIN
+  UPDATE revision SET
+    version = version + 1, modified = now() AT TIME ZONE 'utc';
+  RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE TRIGGER site_revision AFTER INSERT OR UPDATE OR DELETE ON post
+FOR EACH ROW EXECUTE FUNCTION site_revision();
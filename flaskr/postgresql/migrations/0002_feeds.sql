@@ -0,0 +1,9 @@
+-- Feeds rendered when posts change, served as they are.
+
+CREATE TABLE feed (
+  name TEXT PRIMARY KEY,
+  title TEXT NOT NULL,
+  body BYTEA NOT NULL,
+  etag TEXT NOT NULL,
+  updated TIMESTAMP(0) NOT NULL
+);
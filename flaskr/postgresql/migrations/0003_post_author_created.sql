@@ -0,0 +1,5 @@
+-- Author pages and feeds list an author's newest posts, so their posts
+-- are indexed by date as well.
+
+DROP INDEX IF EXISTS post_author_id;
+CREATE INDEX post_author_id_created ON post (author_id, created);
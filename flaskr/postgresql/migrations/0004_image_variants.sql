@@ -0,0 +1,5 @@
+-- Names of the variants made of each image, NULL until they are, so pages
+-- only link the variants that exist. `flask make-variants` makes them for
+-- images uploaded before this.
+
+ALTER TABLE post_image ADD COLUMN variants TEXT;
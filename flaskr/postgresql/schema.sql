@@ -0,0 +1,43 @@
+DROP TABLE IF EXISTS
+  schema_version, "user", post, reaction, comment,
+  post_tag, tag, revision, post_image, feed
+CASCADE;
+
+DROP FUNCTION IF EXISTS
+  post_tag_count, reaction_count, comment_count, post_version, site_revision
+CASCADE;
+
+CREATE TABLE schema_version (
+  version INTEGER NOT NULL
+);
+
+INSERT INTO schema_version (version) VALUES (0);
+
+CREATE TABLE "user" (
+  id SERIAL PRIMARY KEY,
+  username TEXT UNIQUE NOT NULL,
+  password TEXT NOT NULL
+);
+
+-- whole seconds, like SQLite's CURRENT_TIMESTAMP, so page cursors are exact
+CREATE TABLE post (
+  id SERIAL PRIMARY KEY,
+  author_id INTEGER NOT NULL REFERENCES "user" (id),
+  created TIMESTAMP(0) NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+  title TEXT NOT NULL,
+  body TEXT NOT NULL,
+  tags TEXT NOT NULL
+);
+
+CREATE TABLE reaction (
+  post_id INTEGER NOT NULL REFERENCES post (id) ON DELETE CASCADE,
+  user_id INTEGER NOT NULL REFERENCES "user" (id)
+);
+
+CREATE TABLE comment (
+  id SERIAL PRIMARY KEY,
+  post_id INTEGER NOT NULL REFERENCES post (id) ON DELETE CASCADE,
+  author_id INTEGER NOT NULL REFERENCES "user" (id),
+  created TIMESTAMP(0) NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+  body TEXT NOT NULL
+);
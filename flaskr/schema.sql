@@ -1,7 +1,15 @@
+PRAGMA user_version = 0;
+
 DROP TABLE IF EXISTS user;
 DROP TABLE IF EXISTS post;
 DROP TABLE IF EXISTS reaction;
 DROP TABLE IF EXISTS comment;
+DROP TABLE IF EXISTS post_fts;
+DROP TABLE IF EXISTS post_tag;
+DROP TABLE IF EXISTS tag;
+DROP TABLE IF EXISTS revision;
+DROP TABLE IF EXISTS post_image;
+DROP TABLE IF EXISTS feed;
 
 CREATE TABLE user (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
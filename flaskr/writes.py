@@ -0,0 +1,173 @@
+"""Write-behind queue for likes and comments.
+
+With ``WRITE_QUEUE`` on, the like and comment views only queue their
+change and a background thread commits what has been queued in one
+transaction, so a burst of likes takes the write lock once instead of
+once per click. Requests of a user with queued changes wait for them to
+be committed, so users always see their own likes and comments.
+
+Each worker process has its own queue and only knows of the changes it
+queued. A request that another worker handles doesn't wait for them, and
+doesn't see them until their batch is committed, usually within
+``WRITE_BATCH_DELAY``.
+"""
+from collections import Counter
+import queue
+import threading
+import time
+
+from flask import current_app, session
+
+from flaskr.cache import invalidate
+from flaskr.db import get_db
+
+
+def apply_writes(batch):
+    """Commit ``(user_id, op, args)`` changes in one transaction.
+
+    Of several reactions of a user to a post only the last one counts.
+    """
+    reactions = {}
+    comments = []
+    for user_id, op, args in batch:
+        if op == 'react':
+            post_id, liked = args
+            reactions[post_id, user_id] = liked
+        elif op == 'comment':
+            comments.append(args)
+        else:
+            raise ValueError(f'Unknown write {op!r}.')
+
+    db = get_db()
+    with db:
+        db.executemany('''
+            INSERT INTO reaction (post_id, user_id) VALUES (?, ?)
+            ON CONFLICT DO NOTHING''',
+            [key for key, liked in reactions.items() if liked]
+        )
+        db.executemany(
+            'DELETE FROM reaction WHERE post_id = ? AND user_id = ?',
+            [key for key, liked in reactions.items() if not liked]
+        )
+        # the post may have been deleted while the comment was queued
+        db.executemany('''
+            INSERT INTO comment (body, author_id, post_id)
+            SELECT ?, ?, id FROM post WHERE id = ?''',
+            comments
+        )
+
+    invalidate(*{f'post:{post_id}' for post_id, _ in reactions}, *{
+        f'post:{post_id}' for _, _, post_id in comments
+    })
+
+
+class WriteQueue:
+    """Changes waiting to be committed by a background thread."""
+
+    def __init__(self, app, batch_size=200, delay=0.02):
+        self.app = app
+        self.batch_size = batch_size
+        self.delay = delay
+        self._queue = queue.Queue()
+        self._pending = Counter()
+        self._committed = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name='flaskr-writes', daemon=True
+        )
+        self._thread.start()
+
+    def put(self, user_id, op, *args):
+        with self._committed:
+            self._pending[user_id] += 1
+        self._queue.put((user_id, op, args))
+
+    def wait(self, user_id, timeout=None):
+        """Wait until the queued changes of *user_id* are committed."""
+        with self._committed:
+            return self._committed.wait_for(
+                lambda: not self._pending[user_id], timeout
+            )
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        # wait a little for more changes, then commit them all at once
+        deadline = time.monotonic() + self.delay
+        while batch[-1] is not None and len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(
+                    timeout=max(0, deadline - time.monotonic())
+                ))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            if batch:
+                self._commit(batch)
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _commit(self, batch):
+        # a context per batch, so that its connection is released and a
+        # broken one is replaced
+        try:
+            with self.app.app_context():
+                apply_writes(batch)
+        except Exception:
+            # the thread must outlive any failure, or nothing is committed
+            self.app.logger.exception(
+                'Could not commit %d queued changes', len(batch)
+            )
+        finally:
+            with self._committed:
+                for user_id, _, _ in batch:
+                    self._pending[user_id] -= 1
+                    if not self._pending[user_id]:
+                        del self._pending[user_id]
+                self._committed.notify_all()
+
+
+def get_write_queue():
+    """Return the write queue of the current app, or None if disabled."""
+    extensions = current_app.extensions
+    if 'write_queue' not in extensions:
+        config = current_app.config
+        extensions['write_queue'] = WriteQueue(
+            current_app._get_current_object(),
+            config['WRITE_BATCH_SIZE'], config['WRITE_BATCH_DELAY'],
+        ) if config['WRITE_QUEUE'] else None
+    return extensions['write_queue']
+
+
+def submit(user_id, op, *args):
+    """Queue a change, or commit it right away without the queue."""
+    write_queue = get_write_queue()
+    if write_queue is None:
+        apply_writes([(user_id, op, args)])
+    else:
+        write_queue.put(user_id, op, *args)
+
+
+def wait_for_own_writes():
+    write_queue = current_app.extensions.get('write_queue')
+    user_id = session.get('user_id')
+    if write_queue is not None and user_id is not None:
+        write_queue.wait(user_id, current_app.config['WRITE_QUEUE_WAIT'])
+
+
+def init_app(app):
+    app.before_request(wait_for_own_writes)
@@ -2,10 +2,12 @@ import os
 import shutil
 import tempfile
 import io
+from pathlib import Path
 
 import pytest
 from flaskr import create_app
 from flaskr.db import get_db, init_db
+from flaskr.images import shard_dir
 
 with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
     _data_sql = f.read().decode('utf8')
@@ -21,21 +23,35 @@ def app():
         'TESTING': True,
         'DATABASE': db_path,
         'POST_IMAGE_FOLDER': post_image_path,
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'FEED_BASE_URL': 'http://localhost/',
     })
 
     with app.app_context():
         init_db()
         get_db().executescript(_data_sql)
 
-    shutil.copy(_post_image_path, post_image_path)
+    os.makedirs(os.path.join(post_image_path, shard_dir(1)))
+    shutil.copy(_post_image_path, os.path.join(post_image_path, shard_dir(1)))
 
     yield app
 
     os.close(db_fd)
-    os.unlink(db_path)
+    for path in (db_path, db_path + '-wal', db_path + '-shm'):
+        if os.path.exists(path):
+            os.unlink(path)
     shutil.rmtree(post_image_path)
 
 
+@pytest.fixture
+def image_file(app):
+    """Return the path of a file like ``1.gif`` in its image shard."""
+    def image_file(name):
+        id = int(name.partition('.')[0])
+        return Path(app.config['POST_IMAGE_FOLDER'], shard_dir(id), name)
+    return image_file
+
+
 @pytest.fixture
 def client(app):
     return app.test_client()
@@ -67,4 +83,5 @@ def auth(client):
 
 @pytest.fixture
 def jpeg_file():
-    return (io.BytesIO(b"abcdef"), 'test.jpg')
+    # start of image, an empty APP0 segment and end of image
+    return (io.BytesIO(b"\xff\xd8\xff\xe0\x00\x02\xff\xd9"), 'test.jpg')
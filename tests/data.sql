@@ -5,7 +5,7 @@ VALUES
 
 INSERT INTO post (title, body, tags, author_id, created)
 VALUES
-  ('test title 1', '*test***' || x'0a' || '# body', 'test_tag', 1, '2018-01-01 00:00:00'),
+  ('test title 1', '*test***' || x'0a' || '# body', 'test_tag', 1, '2018-01-01 00:00:01'),
   ('test title 2', '', '', 1, '2018-01-01 00:00:00'),
   ('3', '', '', 1, '2018-01-01 00:00:00'),
   ('4', '', '', 1, '2018-01-01 00:00:00'),
@@ -13,6 +13,11 @@ VALUES
   ('6', '', '', 1, '2018-01-01 00:00:00'),
   ('7', '', '', 1, '2018-01-01 00:00:00');
 
+INSERT INTO post_tag (tag, post_id) VALUES ('test_tag', 1);
+
+INSERT INTO post_image (post_id, ext, size, width, height, digest)
+VALUES (1, '.gif', 31275, 100, 100, '3ee570ed6c5a01c8');
+
 INSERT INTO reaction (post_id, user_id) VALUES (1, 1), (2, 1);
 
 INSERT INTO comment (body, post_id, author_id, created)
@@ -55,3 +55,36 @@ def test_logout(client, auth):
     with client:
         auth.logout()
         assert 'user_id' not in session
+
+
+def test_user_kept_in_session(client, auth, app):
+    auth.login()
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE "user" SET username = \'renamed\' WHERE id = 1')
+        db.commit()
+
+    with client:
+        client.get('/')
+        assert g.user == {'id': 1, 'username': 'test'}
+
+    app.config['USER_CHECK_INTERVAL'] = 0
+    with client:
+        client.get('/')
+        assert g.user['username'] == 'renamed'
+
+    with app.app_context():
+        db = get_db()
+        db.execute('DELETE FROM "user" WHERE id = 1')
+        db.commit()
+    with client:
+        client.get('/')
+        assert g.user is None
+        assert 'user_id' not in session
+
+
+def test_user_not_loaded_for_images(client, auth):
+    auth.login()
+    with client:
+        client.get('/1/image-3ee570ed6c5a01c8.gif')
+        assert g.user is None
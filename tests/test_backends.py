@@ -0,0 +1,76 @@
+import os
+
+import pytest
+from flaskr import create_app
+from flaskr.backends import Row, to_format_style
+from flaskr.db import get_backend, get_db, init_db
+
+
+@pytest.mark.parametrize(('sql', 'expected'), (
+    ('SELECT * FROM post WHERE id = ?', 'SELECT * FROM post WHERE id = %s'),
+    ("SELECT '?', ? LIKE 'a%'", "SELECT '?', %s LIKE 'a%%'"),
+    ("SELECT 'it''s ?' || ?", "SELECT 'it''s ?' || %s"),
+))
+def test_to_format_style(sql, expected):
+    assert to_format_style(sql) == expected
+
+
+def test_row():
+    row = Row((1, 'test'), {'id': 0, 'username': 1})
+    assert row['username'] == row[1] == 'test'
+    assert tuple(row) == (1, 'test')
+    assert dict(zip(row.keys(), row)) == {'id': 1, 'username': 'test'}
+
+
+def test_sqlite_backend(app):
+    with app.app_context():
+        assert get_backend().name == 'sqlite'
+
+
+@pytest.fixture
+def pg_app():
+    url = os.environ.get('FLASKR_TEST_POSTGRESQL')
+    if not url:
+        pytest.skip('FLASKR_TEST_POSTGRESQL is not set')
+    pytest.importorskip('psycopg_pool')
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': url,
+        'FEED_BASE_URL': 'http://localhost/',
+    })
+    with app.app_context():
+        init_db()
+    return app
+
+
+def test_postgresql(pg_app, caplog):
+    client = pg_app.test_client()
+    client.post('/auth/register', data={'username': 'a', 'password': 'a'})
+    client.post('/auth/login', data={'username': 'a', 'password': 'a'})
+    for title in ('first', 'second'):
+        client.post('/create', data={
+            'title': title, 'body': '100% *text*', 'tags': 'x y',
+            'image': (None, ''),
+        }, content_type='multipart/form-data')
+    client.post('/1/like')
+    client.post('/1/comment', data={'body': 'hello'})
+
+    assert b'second' in client.get('/?search=sec').data
+    assert b'first' not in client.get('/?search=sec').data
+    assert b'<em>text</em>' in client.get('/1').data
+    assert client.get('/1', headers={
+        'If-None-Match': client.get('/1').headers['ETag']
+    }).status_code == 304
+
+    with pg_app.app_context():
+        assert tuple(get_db().execute(
+            'SELECT like_count, comment_count FROM post WHERE id = ?', (1,)
+        ).fetchone()) == (1, 1)
+        assert [tuple(row) for row in get_db().execute(
+            'SELECT name, post_count FROM tag ORDER BY name'
+        )] == [('x', 2), ('y', 2)]
+
+    client.post('/1/delete')
+    assert client.get('/1').status_code == 404
+    # connections go back to the pool without a transaction left open
+    assert 'rolling back returned connection' not in caplog.text
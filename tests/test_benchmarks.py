@@ -0,0 +1,31 @@
+import json
+
+from benchmarks import run, seed, startup
+
+
+def test_benchmarks(tmp_path, capsys):
+    database = str(tmp_path / 'bench.sqlite')
+    seed.main([database, '--posts', '200', '--images', '0.5'])
+    assert '200 posts' in capsys.readouterr().out
+    assert list((tmp_path / 'bench_images').rglob('*.gif'))
+
+    output = tmp_path / 'results.json'
+    assert run.main([
+        database, '-n', '10', '-t', '2', '--warmup', '1',
+        '--check-queries', '-o', str(output),
+    ]) == 0
+    results = json.loads(output.read_text())['results']
+    assert set(results) == set(run.QUERY_BUDGETS)
+    assert results['rss']['queries'] == 1
+
+    # a run with more queries than the baseline is a regression
+    results['index']['queries'] = 0
+    output.write_text(json.dumps({'results': results}))
+    assert run.main([
+        database, '-e', 'index', '-n', '2', '--warmup', '0',
+        '--check-queries', '--compare', str(output), '--tolerance', '1000',
+    ]) == 1
+    assert 'index: queries 0 -> 2' in capsys.readouterr().err
+
+    startup.main([database, '-r', '1'])
+    assert 'first_request' in capsys.readouterr().out
@@ -1,4 +1,3 @@
-from pathlib import Path
 from contextlib import nullcontext as does_not_raise
 from xml.etree import ElementTree as ET
 
@@ -25,6 +24,24 @@ def test_index(client, auth):
     assert '💙&nbsp;1' in response.data.decode('utf-8')
 
 
+def test_counters(client, auth, app):
+    def get_counts():
+        with app.app_context():
+            return tuple(get_db().execute(
+                'SELECT like_count, comment_count FROM post WHERE id = 2'
+            ).fetchone())
+
+    assert get_counts() == (1, 0)
+    auth.login()
+    client.post('/2/like')
+    client.post('/2/comment', data={'body': 'hello'})
+    client.post('/2/comment', data={'body': 'again'})
+    assert get_counts() == (0, 2)
+    client.post('/delete_comment/2')
+    assert get_counts() == (0, 1)
+    assert '🤍&nbsp;0' in client.get('/2').data.decode('utf-8')
+
+
 def test_show_tagged(client):
     response = client.get('/tag/test_tag')
     assert 'with tag “test_tag”' in response.data.decode('utf-8')
@@ -32,6 +49,40 @@ def test_show_tagged(client):
     assert b'test title 2' not in response.data
 
 
+def test_tag_counts(client, auth, app):
+    def get_counts():
+        with app.app_context():
+            return dict(get_db().execute(
+                'SELECT name, post_count FROM tag'
+            ).fetchall())
+
+    auth.login()
+    client.post(
+        '/create',
+        data={
+            'title': 't', 'body': '', 'tags': 'a test_tag a',
+            'image': (None, ''),
+        },
+        content_type='multipart/form-data',
+    )
+    assert get_counts() == {'a': 1, 'test_tag': 2}
+    assert b'href="/8"' in client.get('/tag/a').data
+
+    client.post(
+        '/8/update',
+        data={'title': 't', 'body': '', 'tags': 'b', 'image': (None, '')},
+        content_type='multipart/form-data',
+    )
+    assert get_counts() == {'b': 1, 'test_tag': 1}
+    assert b'href="/8"' not in client.get('/tag/a').data
+
+    client.post('/1/delete')
+    assert get_counts() == {'b': 1}
+
+    response = client.get('/tags')
+    assert b'href="/tag/b">b</a> (1)' in response.data
+
+
 def test_search(client):
     response = client.get('/?search=title')
     assert 'for “title”' in response.data.decode('utf-8')
@@ -42,6 +93,42 @@ def test_search(client):
     assert b'test title 2' not in response.data
 
 
+def test_search_ranked(client, app):
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET body = 'mentions needle' WHERE id = 2")
+        db.execute("UPDATE post SET title = 'needle' WHERE id = 3")
+        db.commit()
+
+    data = client.get('/?search=needle').data
+    assert b'mentions needle' in data
+    assert data.index(b'/3"') < data.index(b'/2"')
+    assert b'title="Next page"' not in data
+
+
+def test_search_index_in_sync(client, auth, app):
+    auth.login()
+    client.post(
+        '/1/update',
+        data={'title': 'renamed', 'body': '', 'tags': '', 'image': (None, '')},
+        content_type='multipart/form-data',
+    )
+    assert b'href="/1"' in client.get('/?search=renamed').data
+    assert b'href="/1"' not in client.get('/?search=title 1').data
+    client.post('/1/delete')
+    assert b'href="/1"' not in client.get('/?search=renamed').data
+
+    with app.app_context():
+        assert get_db().execute(
+            "SELECT COUNT(*) FROM post_fts WHERE post_fts MATCH 'renamed'"
+        ).fetchone()[0] == 0
+
+
+@pytest.mark.parametrize('search', ('"', 'OR', 'title*', 'NEAR(a b)', '-'))
+def test_search_syntax_is_escaped(client, search):
+    assert client.get('/', query_string={'search': search}).status_code == 200
+
+
 @pytest.mark.parametrize('path', (
     '/create',
     '/1/update',
@@ -82,7 +169,7 @@ def test_exists_required(client, auth, path):
     assert client.post(path).status_code == 404
 
 
-def test_create(client, auth, app, jpeg_file):
+def test_create(client, auth, app, jpeg_file, image_file):
     auth.login()
     assert client.get('/create').status_code == 200
     client.post(
@@ -96,14 +183,59 @@ def test_create(client, auth, app, jpeg_file):
         count = db.execute('SELECT COUNT(id) FROM post').fetchone()[0]
         assert count == 8
 
-    assert Path(app.config['POST_IMAGE_FOLDER'], '8.jpg').exists()
+    assert image_file('8.jpg').exists()
 
     client.post(
         '/create',
         data={'title': 'created', 'body': '', 'tags': '', 'image': (None, '')},
         content_type='multipart/form-data',
     )
-    assert not Path(app.config['POST_IMAGE_FOLDER'], '9.jpg').exists()
+    assert not image_file('9.jpg').exists()
+
+
+def test_rendered_body(client, auth, app):
+    auth.login()
+    client.post(
+        '/1/update',
+        data={
+            'title': 't', 'body': '**bold**', 'tags': '', 'image': (None, ''),
+        },
+        content_type='multipart/form-data',
+    )
+
+    with app.app_context():
+        db = get_db()
+        post = db.execute('SELECT * FROM post WHERE id = 1').fetchone()
+        assert post['body_html'] == '<p><strong>bold</strong></p>'
+        assert post['body_text'] == 'bold'
+        # views use the stored rendering instead of converting again
+        db.execute(
+            "UPDATE post SET body_html = '<p>cached</p>', body_text = 'cached'"
+        )
+        db.commit()
+
+    assert b'<p>cached</p>' in client.get('/1').data
+    assert b'<p class="body">cached</p>' in client.get('/').data
+
+
+def test_render_posts_command(runner, app):
+    result = runner.invoke(args=['render-posts'])
+    assert 'Rendered 7 posts.' in result.output
+    result = runner.invoke(args=['render-posts'])
+    assert 'Rendered 0 posts.' in result.output
+
+    with app.app_context():
+        db = get_db()
+        post = db.execute('SELECT * FROM post WHERE id = 1').fetchone()
+        assert post['body_html'] == '<p><em>test</em>**</p>\n<h1>body</h1>'
+        assert post['body_text'] == 'test** body'
+        db.execute("UPDATE post SET body = 'edited' WHERE id = 2")
+        db.commit()
+
+    result = runner.invoke(args=['render-posts'])
+    assert 'Rendered 1 posts.' in result.output
+    result = runner.invoke(args=['render-posts', '--all'])
+    assert 'Rendered 7 posts.' in result.output
 
 
 def test_read(client, auth):
@@ -114,8 +246,10 @@ def test_read(client, auth):
     assert '🤍&nbsp;1' in response.data.decode('utf-8')
     assert b'1 comments' in response.data
     assert b'test_tag' in response.data
-    assert b'src="/1/image.gif"' in response.data
-    response = client.get('/1/image.gif')
+    # no variants are made of it, so the original is linked
+    assert b'src="/1/image-3ee570ed6c5a01c8.gif"' in response.data
+    assert b'srcset' not in response.data
+    response = client.get('/1/image-3ee570ed6c5a01c8.gif')
     assert response.data[:5] == b'GIF89'
 
     auth.login()
@@ -123,10 +257,10 @@ def test_read(client, auth):
     assert b'href="/2/update"' in response.data
     assert b'action="/2/like"' in response.data
     assert '💙&nbsp;1' in response.data.decode('utf-8')
-    assert b'src="/2/image.gif"' not in response.data
+    assert b'src="/2/image' not in response.data
 
 
-def test_update(client, auth, app, jpeg_file):
+def test_update(client, auth, app, jpeg_file, image_file):
     auth.login()
     assert client.get('/1/update').status_code == 200
     response = client.post(
@@ -141,7 +275,7 @@ def test_update(client, auth, app, jpeg_file):
         post = db.execute('SELECT * FROM post WHERE id = 1').fetchone()
         assert post['title'] == 'updated'
 
-    assert not Path(app.config['POST_IMAGE_FOLDER'], '1.jpg').exists()
+    assert not image_file('1.jpg').exists()
 
     response = client.post(
         '/1/update',
@@ -149,7 +283,7 @@ def test_update(client, auth, app, jpeg_file):
         content_type='multipart/form-data',
     )
 
-    assert Path(app.config['POST_IMAGE_FOLDER'], '1.jpg').exists()
+    assert image_file('1.jpg').exists()
 
 
 @pytest.mark.parametrize('path', (
@@ -186,7 +320,7 @@ def test_comment_validate(client, auth):
     assert b'Message is required.' in response.data
 
 
-def test_delete(client, auth, app):
+def test_delete(client, auth, app, image_file):
     auth.login()
     response = client.post('/1/delete')
     assert response.headers['Location'] == '/'
@@ -196,7 +330,7 @@ def test_delete(client, auth, app):
         post = db.execute('SELECT * FROM post WHERE id = 1').fetchone()
         assert post is None
 
-    assert not Path(app.config['POST_IMAGE_FOLDER'], '1.jpg').exists()
+    assert not image_file('1.jpg').exists()
 
 
 def test_like(client, auth, app):
@@ -239,20 +373,91 @@ def test_delete_comment(client, auth, app):
 
 
 def test_pages(client):
+    # newest first: 1 | 7 6 5 4 | 3 2, all but post 1 share a timestamp
     response = client.get('/')
     assert b'title="Previous page"' not in response.data
     assert b'<span>1</span>' in response.data
-    assert b'href="/?start=5"' in response.data
+    assert b'href="/?after=1514764800-4&page=2"' in response.data
+    assert b'test title 1' in response.data
 
-    response = client.get('/?start=5')
-    assert b'href="/?start=0"' in response.data
+    response = client.get('/?after=1514764800-4&page=2')
+    assert b'href="/"' in response.data
     assert b'<span>2</span>' in response.data
     assert b'title="Next page"' not in response.data
+    assert b'href="/3"' in response.data
+    assert b'href="/2"' in response.data
+
+    response = client.get('/?before=1514764800-2&page=3')
+    assert b'href="/?before=1514764800-7&page=2"' in response.data
+    assert b'<span>3</span>' in response.data
+    assert b'href="/?after=1514764800-3&page=4"' in response.data
+    assert b'href="/1"' not in response.data
 
-    response = client.get('/?start=1')
-    assert b'href="/?start=0"' in response.data
+    response = client.get('/?before=1514764800-3&page=2')
+    assert b'<span>1</span>' in response.data
+    assert b'title="Previous page"' not in response.data
+    assert b'test title 1' in response.data
+
+    response = client.get('/?after=garbage')
+    assert b'<span>1</span>' in response.data
+
+    for cursor in ('after=1-99999999999999999999999',
+                   'before=1-99999999999999999999999',
+                   'after=99999999999999-1', 'before=-99999999999999-1'):
+        response = client.get(f'/?{cursor}&page=2')
+        assert response.status_code == 200
+        assert b'test title 1' in response.data
+
+
+def test_search_pages(client, app):
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'many'")
+        db.commit()
+
+    response = client.get('/?search=many')
+    assert b'href="/?search=many&start=5"' in response.data
+    response = client.get('/?search=many&start=5')
+    assert b'href="/?search=many&start=0"' in response.data
     assert b'<span>2</span>' in response.data
-    assert b'href="/?start=6"' in response.data
+    assert b'title="Next page"' not in response.data
+
+
+def test_conditional_get(client, auth):
+    response = client.get('/1')
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified']
+    assert 'Cookie' in response.headers['Vary']
+    response = client.get('/1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    index = client.get('/rss.xml')
+    response = client.get('/rss.xml', headers={
+        'If-Modified-Since': index.headers['Last-Modified'],
+    })
+    assert response.status_code == 304
+
+    auth.login()
+    # pages differ per user, so validators do too
+    assert client.get('/1', headers={'If-None-Match': etag}).status_code == 200
+    user_etag = client.get('/1').headers['ETag']
+    client.post('/1/like')
+    response = client.get('/1', headers={'If-None-Match': user_etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != user_etag
+    etag = response.headers['ETag']
+    response = client.get('/1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_site_revision(client, auth):
+    etag = client.get('/').headers['ETag']
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+    auth.login()
+    client.post('/2/comment', data={'body': 'hello'})
+    auth.logout()
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 200
 
 
 def test_rss(client):
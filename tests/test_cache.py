@@ -0,0 +1,118 @@
+import os
+
+import pytest
+from flaskr.cache import FileSystemCache, MemoryCache, PageCache, invalidate
+
+
+def test_memory_cache_lru():
+    cache = MemoryCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert len(cache) == 2
+
+
+@pytest.mark.parametrize('make_backend', (
+    lambda path: MemoryCache(ttl=0),
+    lambda path: FileSystemCache(path, ttl=-1),
+))
+def test_expiry(tmp_path, make_backend):
+    cache = make_backend(tmp_path)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_file_system_cache_pruned(tmp_path):
+    cache = FileSystemCache(tmp_path, max_entries=4)
+    for mtime, key in enumerate('abcd', 1):
+        cache.set(key, key)
+        os.utime(cache._path(key), (mtime, mtime))
+    assert len(cache) == 4
+    cache.set('e', 'e')
+    assert len(cache) == 3
+    assert [cache.get(key) for key in 'abcde'] == [None, None, 'c', 'd', 'e']
+    assert len(os.listdir(tmp_path)) == 3
+
+
+def test_page_cache_invalidation(tmp_path):
+    cache = PageCache(FileSystemCache(tmp_path))
+    cache.set('/', b'index', {
+        tag: cache.token(tag) for tag in ('posts', 'post:1')
+    })
+    cache.set('/2', b'post', {'post:2': cache.token('post:2')})
+    assert cache.get('/') == b'index'
+
+    cache.invalidate('post:1')
+    assert cache.get('/') is None
+    assert cache.get('/2') == b'post'
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'entries': 5}
+
+
+@pytest.fixture
+def cached_app(app):
+    app.config['PAGE_CACHE'] = 'memory'
+    return app
+
+
+def test_anonymous_pages_cached(cached_app, client, auth):
+    for path in ('/', '/1', '/tags', '/tag/test_tag'):
+        assert client.get(path).headers['X-Cache'] == 'MISS'
+        response = client.get(path)
+        assert response.headers['X-Cache'] == 'HIT'
+        assert response.headers['ETag']
+
+    etag = client.get('/1').headers['ETag']
+    assert client.get('/1', headers={'If-None-Match': etag}).status_code == 304
+
+    auth.login()
+    assert 'X-Cache' not in client.get('/').headers
+
+    stats = client.get('/cache/stats').get_json()
+    assert stats['hits'] == 6
+    assert stats['misses'] == 4
+
+
+def test_write_invalidates(cached_app, client, auth):
+    for path in ('/', '/1', '/2'):
+        client.get(path)
+
+    auth.login()
+    client.post('/2/like')
+    auth.logout()
+    assert client.get('/2').headers['X-Cache'] == 'MISS'
+    assert '🤍&nbsp;0' in client.get('/2').data.decode('utf-8')
+    assert client.get('/1').headers['X-Cache'] == 'HIT'
+    # post 2 is listed on the second page only
+    assert client.get('/').headers['X-Cache'] == 'HIT'
+
+    auth.login()
+    client.post('/1/update', data={
+        'title': 'updated', 'body': '', 'tags': '', 'image': (None, ''),
+    }, content_type='multipart/form-data')
+    auth.logout()
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+    assert b'updated' in client.get('/rss.xml').data
+
+
+def test_change_while_rendering(cached_app, client, monkeypatch):
+    from flaskr import blog
+
+    select_page = blog.select_page
+
+    def select_page_before_like(*args, **kwargs):
+        page = select_page(*args, **kwargs)
+        # a like of a listed post is committed right after the page loads
+        invalidate('post:1')
+        return page
+
+    monkeypatch.setattr(blog, 'select_page', select_page_before_like)
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+
+    monkeypatch.undo()
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+    assert client.get('/').headers['X-Cache'] == 'HIT'
@@ -1,18 +1,58 @@
 import sqlite3
+import threading
 
 import pytest
-from flaskr.db import get_db
+from flaskr.db import get_db, get_migrations, get_schema_version
 
 
 def test_get_close_db(app):
     with app.app_context():
         db = get_db()
         assert db is get_db()
+        db.execute("INSERT INTO user (username, password) VALUES ('x', '')")
 
-    with pytest.raises(sqlite3.ProgrammingError) as e:
-        db.execute('SELECT 1')
+    # the thread keeps its connection, without the unfinished transaction
+    with app.app_context():
+        assert get_db() is db
+        assert not db.in_transaction
+        assert db.execute(
+            "SELECT COUNT(*) FROM user WHERE username = 'x'"
+        ).fetchone()[0] == 0
+
+
+def test_connection_per_thread(app):
+    def connect():
+        with app.app_context():
+            connections.append(get_db())
+
+    connections = []
+    connect()
+    thread = threading.Thread(target=connect)
+    thread.start()
+    thread.join()
+    connect()
+    assert connections[0] is connections[2]
+    assert connections[0] is not connections[1]
+
+
+def test_pragmas(app):
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA synchronous').fetchone()[0] == 1
+        assert db.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+
+
+def test_read_only_views(app):
+    with app.test_request_context('/1'):
+        db = get_db()
+        assert db.execute('PRAGMA query_only').fetchone()[0] == 1
+        with pytest.raises(sqlite3.OperationalError):
+            db.execute("INSERT INTO tag (name) VALUES ('x')")
 
-    assert 'closed' in str(e.value)
+    with app.test_request_context('/1/like', method='POST'):
+        assert get_db() is not db
+        assert get_db().execute('PRAGMA query_only').fetchone()[0] == 0
 
 
 def test_init_db_command(runner, monkeypatch):
@@ -26,3 +66,115 @@ def test_init_db_command(runner, monkeypatch):
     result = runner.invoke(args=['init-db'])
     assert 'Initialized' in result.output
     assert Recorder.called
+
+
+def test_migrate_command(runner, app):
+    with app.app_context():
+        # start from a database created before any migration existed
+        db = get_db()
+        with app.open_resource('schema.sql') as f:
+            db.executescript(f.read().decode('utf8'))
+        db.executescript("""
+            INSERT INTO user (username, password) VALUES ('test', '');
+            INSERT INTO post (title, body, tags, author_id)
+            VALUES ('old', 'searchable', 'x  y x', 1);
+            INSERT INTO reaction (post_id, user_id) VALUES (1, 1), (1, 1);
+        """)
+        assert get_schema_version() == 0
+
+    result = runner.invoke(args=['migrate'])
+    assert 'Applied 0001_post_fts.sql' in result.output
+    assert 'Applied 0003_indexes.sql' in result.output
+    result = runner.invoke(args=['migrate'])
+    assert 'Applied' not in result.output
+
+    with app.app_context():
+        db = get_db()
+        version = get_migrations()[-1][0]
+        assert get_schema_version() == version
+        assert f'version {version}' in result.output
+        assert [tuple(row) for row in db.execute(
+            'SELECT tag, post_id FROM post_tag ORDER BY tag'
+        )] == [('x', 1), ('y', 1)]
+        assert db.execute(
+            "SELECT rowid FROM post_fts WHERE post_fts MATCH 'searchable'"
+        ).fetchone()[0] == 1
+        assert db.execute('SELECT COUNT(*) FROM reaction').fetchone()[0] == 1
+        with pytest.raises(sqlite3.IntegrityError):
+            db.execute('INSERT INTO reaction (post_id, user_id) VALUES (1, 1)')
+
+
+def test_init_db_is_migrated(app):
+    with app.app_context():
+        assert get_schema_version() == get_migrations()[-1][0]
+        indexes = {row['name'] for row in get_db().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'"
+        )}
+        assert {'post_created', 'comment_post_id_created'} <= indexes
+
+
+def test_recount_command(runner, app):
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE post SET like_count = 5, comment_count = 3')
+        db.execute('UPDATE post SET like_count = 1 WHERE id = 2')
+        db.commit()
+
+    result = runner.invoke(args=['recount', '--check'])
+    assert 'Stale counters for posts: 1, 2, 3' in result.output
+    result = runner.invoke(args=['recount'])
+    assert 'Recounted posts: 1, 2, 3' in result.output
+    result = runner.invoke(args=['recount'])
+    assert 'All counters are correct.' in result.output
+
+    with app.app_context():
+        assert [tuple(row) for row in get_db().execute(
+            'SELECT like_count, comment_count FROM post WHERE id <= 2'
+        )] == [(1, 1), (1, 0)]
+
+
+def test_slow_query_log(app, client, caplog):
+    client.get('/1')
+    assert 'Slow query' not in caplog.text
+
+    app.config['SLOW_QUERY_THRESHOLD'] = 0
+    client.get('/1')
+    assert 'Slow query' in caplog.text
+    assert 'in GET /1:' in caplog.text
+    assert 'parameters: (1,)' in caplog.text
+    assert 'SEARCH c USING INDEX comment_post_id_created' in caplog.text
+
+
+def test_check_queries_command(runner, app, image_file):
+    def count_rows():
+        with app.app_context():
+            return [
+                get_db().execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('post', 'comment', 'reaction', 'feed')
+            ]
+
+    rows = count_rows()
+    result = runner.invoke(args=['check-queries'])
+    assert result.exit_code == 0
+    assert 'SELECT' not in result.output
+    assert ', 0 scan a table' in result.output
+
+    result = runner.invoke(args=['check-queries', '--all'])
+    assert result.exit_code == 0
+    assert 'SEARCH post USING INTEGER PRIMARY KEY' in result.output
+    assert 'INSERT INTO comment' in result.output
+    # the revision has a single row, the tag cloud lists every tag
+    assert '  SCAN revision' in result.output
+    assert '~ SCAN tag' in result.output
+    assert count_rows() == rows
+    assert image_file('1.gif').exists()
+
+
+def test_check_queries_missing_index(runner, app):
+    with app.app_context():
+        get_db().execute('DROP INDEX post_created')
+        get_db().commit()
+    result = runner.invoke(args=['check-queries'])
+    assert result.exit_code == 1
+    assert 'ORDER BY p.created DESC, p.id DESC' in result.output
+    assert '! USE TEMP B-TREE FOR ORDER BY' in result.output
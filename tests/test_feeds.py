@@ -0,0 +1,150 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+from flaskr.db import get_db
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+DC = '{http://purl.org/dc/elements/1.1/}'
+
+
+def test_atom(client):
+    response = client.get('/atom.xml')
+    assert response.mimetype == 'application/atom+xml'
+    feed = ET.fromstring(response.data)
+    entries = feed.findall(f'{ATOM}entry')
+    assert len(entries) == 7
+    assert entries[0].find(f'{ATOM}title').text == 'test title 1'
+    assert entries[0].find(f'{ATOM}link').get('href') == 'http://localhost/1'
+
+
+def test_rss(client):
+    channel = ET.fromstring(client.get('/rss.xml').data).find('channel')
+    item = channel.find('item')
+    # <author> is for email addresses
+    assert item.find('author') is None
+    assert item.find(f'{DC}creator').text == 'test'
+
+
+def test_first_poll_locks_writes(client, app, monkeypatch):
+    from flaskr import feeds
+
+    select_feed_posts = feeds.select_feed_posts
+
+    def select_locked(scope):
+        if scope:
+            # a post write committing now would miss the new feed
+            assert get_db().in_transaction
+        return select_feed_posts(scope)
+
+    monkeypatch.setattr(feeds, 'select_feed_posts', select_locked)
+    assert client.get('/tag/test_tag/rss.xml').status_code == 200
+
+
+def test_feed_stored(client, app):
+    etag = client.get('/rss.xml').headers['ETag']
+    response = client.get('/rss.xml', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    with app.app_context():
+        # polls read the stored feed, so they don't see changes made
+        # behind the app's back
+        get_db().execute("UPDATE post SET title = 'changed' WHERE id = 1")
+        get_db().commit()
+    assert b'changed' not in client.get('/rss.xml').data
+
+
+@pytest.mark.parametrize(('path', 'titles'), (
+    ('/tag/test_tag/rss.xml', ['test title 1']),
+    ('/author/other/atom.xml', []),
+))
+def test_scoped_feeds(client, path, titles):
+    feed = ET.fromstring(client.get(path).data)
+    entries = feed.findall('channel/item') + feed.findall(f'{ATOM}entry')
+    assert [
+        entry.find(f'{ATOM}title' if entry.tag != 'item' else 'title').text
+        for entry in entries
+    ] == titles
+
+
+@pytest.mark.parametrize('path', (
+    '/tag/missing/rss.xml',
+    '/author/missing/atom.xml',
+    '/rss.json',
+))
+def test_missing_feed(client, app, path):
+    assert client.get(path).status_code == 404
+    with app.app_context():
+        assert get_db().execute(
+            "SELECT COUNT(*) FROM feed WHERE name LIKE '%missing%'"
+        ).fetchone()[0] == 0
+
+
+def test_write_refreshes_feeds(client, auth):
+    etags = {
+        path: client.get(path).headers['ETag']
+        for path in ('/rss.xml', '/tag/test_tag/atom.xml',
+                     '/author/test/rss.xml', '/author/other/rss.xml')
+    }
+    auth.login()
+    client.post('/1/update', data={
+        'title': 'updated', 'body': '', 'tags': 'new_tag', 'image': (None, ''),
+    }, content_type='multipart/form-data')
+
+    for path, etag in etags.items():
+        response = client.get(path, headers={'If-None-Match': etag})
+        if path == '/author/other/rss.xml':
+            assert response.status_code == 304
+        else:
+            assert response.status_code == 200
+    assert b'>updated<' not in client.get('/tag/test_tag/atom.xml').data
+    assert b'>updated<' in client.get('/tag/new_tag/atom.xml').data
+
+    client.post('/1/delete')
+    assert b'>updated<' not in client.get('/rss.xml').data
+
+
+def test_feed_base_url(client, app):
+    app.config['FEED_BASE_URL'] = 'https://blog.example.com/'
+    data = client.get('/rss.xml', headers={'Host': 'evil.example'}).data
+    assert b'https://blog.example.com/1' in data
+    assert b'evil.example' not in data
+
+
+def test_feed_server_name(client, app):
+    app.config.update(
+        FEED_BASE_URL=None, SERVER_NAME='blog.example.com',
+        PREFERRED_URL_SCHEME='https', APPLICATION_ROOT='/blog',
+    )
+    data = client.get('/rss.xml', base_url='https://blog.example.com').data
+    assert b'https://blog.example.com/blog/1' in data
+
+
+def test_feed_without_base_url(client, auth, app, caplog):
+    app.config['FEED_BASE_URL'] = None
+    auth.login()
+    response = client.post('/create', data={
+        'title': 'created', 'body': '', 'tags': '', 'image': (None, ''),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 302
+    assert 'FEED_BASE_URL' in caplog.text
+
+    data = client.get('/rss.xml', headers={'Host': 'evil.example'}).data
+    assert b'<link>/8</link>' in data
+    assert b'evil.example' not in data
+
+
+def test_feed_links(client):
+    assert b'href="/tag/test_tag/atom.xml"' in client.get('/tag/test_tag').data
+    assert b'href="/atom.xml"' in client.get('/').data
+
+
+def test_refresh_feeds_command(runner, client, app):
+    client.get('/rss.xml')
+    client.get('/tag/test_tag/rss.xml')
+    with app.app_context():
+        get_db().execute("UPDATE post SET title = 'changed' WHERE id = 1")
+        get_db().commit()
+
+    result = runner.invoke(args=['refresh-feeds'])
+    assert 'Refreshed 2 feeds.' in result.output
+    assert b'changed' in client.get('/tag/test_tag/rss.xml').data
@@ -0,0 +1,314 @@
+import io
+import shutil
+import struct
+from hashlib import sha256
+from pathlib import Path
+
+import pytest
+from flaskr.db import get_db
+from flaskr.images import read_image_size
+
+GIF_URL = '/1/image-3ee570ed6c5a01c8.gif'
+
+
+@pytest.mark.parametrize(('data', 'size'), (
+    (b'GIF89a' + struct.pack('<HH', 3, 2), (3, 2)),
+    (
+        b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR' + struct.pack('>II', 640, 480),
+        (640, 480),
+    ),
+    (b'BM' + bytes(16) + struct.pack('<ii', 5, -7), (5, 7)),
+    (
+        b'\xff\xd8'
+        + b'\xff\xe0' + struct.pack('>H', 6) + b'JFIF'
+        + b'\xff\xc0' + struct.pack('>HBHH', 11, 8, 20, 30),
+        (30, 20),
+    ),
+    (
+        b'RIFF\x00\x00\x00\x00WEBPVP8X' + bytes(8)
+        + (99).to_bytes(3, 'little') + (49).to_bytes(3, 'little'),
+        (100, 50),
+    ),
+    (b'abcdef', None),
+    (b'\xff\xd8\xff', None),
+))
+def test_read_image_size(data, size):
+    assert read_image_size(io.BytesIO(data)) == size
+
+
+def test_image_metadata(client, auth, app, jpeg_file, image_file):
+    digest = sha256(jpeg_file[0].getvalue()).hexdigest()[:16]
+    auth.login()
+    client.post(
+        '/1/update',
+        data={'title': 't', 'body': '', 'tags': '', 'image': jpeg_file},
+        content_type='multipart/form-data',
+    )
+
+    with app.app_context():
+        image = get_db().execute(
+            'SELECT * FROM post_image WHERE post_id = 1'
+        ).fetchone()
+        assert tuple(image) == (1, '.jpg', 8, None, None, digest, None)
+
+    assert not image_file('1.gif').exists()
+    # Pillow can't read it, so there are no variants to link
+    src = f'src="/1/image-{digest}.jpg"'.encode()
+    assert src in client.get('/1').data
+
+
+def copy_image(image_file, name):
+    image_file(name).parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy(image_file('1.gif'), image_file(name))
+
+
+def test_image_format_sniffed(client, auth, image_file):
+    auth.login()
+    with open(image_file('1.gif'), 'rb') as f:
+        upload(client, (io.BytesIO(f.read()), 'disguised.jpg'))
+    assert image_file('1.gif').exists()
+    assert not image_file('1.jpg').exists()
+
+    response = client.post('/1/update', data={
+        'title': 't', 'body': '', 'tags': '',
+        'image': (io.BytesIO(b'<?php'), 'script.gif'),
+    }, content_type='multipart/form-data')
+    assert b'Invalid image file type.' in response.data
+
+
+def test_upload_size_limits(client, auth, app, image_file):
+    app.config['IMAGE_MAX_SIZE'] = 1024
+    auth.login()
+    response = client.post('/1/update', data={
+        'title': 't', 'body': '', 'tags': '',
+        'image': (io.BytesIO(b'GIF89a' + bytes(2000)), 'big.gif'),
+    }, content_type='multipart/form-data')
+    assert b'Image is larger than 1 KiB.' in response.data
+    assert [p.suffix for p in image_file('1.gif').parent.iterdir()] \
+        == ['.gif']
+    assert not any(
+        p.suffix == '.part'
+        for p in Path(app.config['POST_IMAGE_FOLDER']).iterdir()
+    )
+
+    app.config['MAX_CONTENT_LENGTH'] = 1024
+    response = client.post('/1/update', data={
+        'title': 't', 'body': '', 'tags': '',
+        'image': (io.BytesIO(bytes(2000)), 'big.gif'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 413
+
+
+@pytest.mark.parametrize('path', ('/create', '/1/update'))
+def test_failed_write_removes_upload(
+    client, auth, app, monkeypatch, image_file, path
+):
+    def fail(*args):
+        raise RuntimeError('saving tags failed')
+
+    monkeypatch.setattr('flaskr.blog.save_tags', fail)
+    auth.login()
+    with open(image_file('1.gif'), 'rb') as f, \
+            pytest.raises(RuntimeError):
+        client.post(path, data={
+            'title': 't', 'body': '', 'tags': '',
+            'image': (io.BytesIO(f.read()), 'new.gif'),
+        }, content_type='multipart/form-data')
+    assert not any(
+        p.suffix == '.part'
+        for p in Path(app.config['POST_IMAGE_FOLDER']).iterdir()
+    )
+
+
+def test_read_ignores_similar_file_names(client, image_file):
+    # 10.gif used to be picked up as the image of post 1 and vice versa
+    copy_image(image_file, '10.gif')
+    assert b'src="/2/image' not in client.get('/2').data
+    assert b'width="100" height="100"' in client.get('/1').data
+
+
+def test_scan_images_command(runner, app, image_file):
+    folder = app.config['POST_IMAGE_FOLDER']
+    copy_image(image_file, '2.gif')
+    copy_image(image_file, '99.gif')
+    # outside its shard, so not found at the path it would be served from
+    shutil.copy(image_file('1.gif'), Path(folder, '3.gif'))
+    Path(folder, 'notes.txt').write_text('')
+
+    result = runner.invoke(args=['scan-images'])
+    assert 'Recorded 1 images, hashed 0.' in result.output
+    result = runner.invoke(args=['scan-images'])
+    assert 'Recorded 0 images, hashed 0.' in result.output
+
+    with app.app_context():
+        image = get_db().execute(
+            'SELECT * FROM post_image WHERE post_id = 2'
+        ).fetchone()
+        assert tuple(image) == (
+            2, '.gif', 31275, 100, 100, '3ee570ed6c5a01c8', None
+        )
+
+
+@pytest.fixture
+def png_file():
+    Image = pytest.importorskip('PIL.Image')
+    stream = io.BytesIO()
+    Image.new('RGB', (2000, 1000), 'red').save(stream, 'PNG')
+    stream.seek(0)
+    return stream, 'big.png'
+
+
+def upload(client, file):
+    client.post(
+        '/1/update',
+        data={'title': 't', 'body': '', 'tags': '', 'image': file},
+        content_type='multipart/form-data',
+    )
+
+
+def test_variants(client, auth, app, png_file, image_file):
+    from PIL import Image
+
+    app.config['IMAGE_WORKERS'] = 0
+    auth.login()
+    upload(client, png_file)
+
+    with Image.open(image_file('1.thumb.png')) as image:
+        assert image.size == (320, 160)
+    with Image.open(image_file('1.display.webp')) as image:
+        assert image.size == (1280, 640)
+
+    response = client.get('/1')
+    url = client.get('/1/image.png').location
+    assert f'{url}?size=thumb 320w'.encode() in response.data
+    assert b'width="1280" height="640"' in response.data
+
+    response = client.get(
+        url + '?size=thumb', headers={'Accept': 'image/webp,*/*'}
+    )
+    assert response.mimetype == 'image/webp'
+    assert 'Accept' in response.headers['Vary']
+    assert response.cache_control.immutable
+    response = client.get(url + '?size=thumb')
+    assert response.mimetype == 'image/png'
+    assert response.cache_control.immutable
+    assert len(response.data) < len(client.get(url).data)
+
+    # the WebP variant is written last
+    image_file('1.thumb.webp').unlink()
+    response = client.get(
+        url + '?size=thumb', headers={'Accept': 'image/webp,*/*'}
+    )
+    assert response.mimetype == 'image/png'
+    assert not response.cache_control.immutable
+
+    upload(client, (None, ''))
+    assert list(image_file('1.png').parent.iterdir()) == []
+
+
+def test_variants_in_worker_pool(client, auth, app, png_file, image_file):
+    auth.login()
+    upload(client, png_file)
+    app.extensions['image_executor'].shutdown(wait=True)
+    assert image_file('1.display.png').exists()
+    assert b'?size=thumb 320w' in client.get('/1').data
+
+
+def test_make_variants_command(runner, client, image_file):
+    pytest.importorskip('PIL')
+    result = runner.invoke(args=['make-variants'])
+    assert 'Made the variants of 1 of 1 images.' in result.output
+    assert image_file('1.thumb.webp').exists()
+
+    data = client.get('/1').data
+    assert f'src="{GIF_URL}?size=display"'.encode() in data
+    assert f'{GIF_URL}?size=thumb 100w'.encode() in data
+    response = client.get(GIF_URL + '?size=thumb')
+    assert response.cache_control.immutable
+
+    result = runner.invoke(args=['make-variants'])
+    assert 'Made the variants of 0 of 0 images.' in result.output
+
+
+def test_variants_fall_back_to_original(client):
+    response = client.get(
+        GIF_URL + '?size=thumb', headers={'Accept': 'image/webp'}
+    )
+    assert response.data[:5] == b'GIF89'
+    # the variant may be made later under the same URL
+    assert not response.cache_control.immutable
+    assert response.cache_control.max_age == 60
+
+
+def test_image_cached_forever(client):
+    response = client.get(GIF_URL)
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 365 * 24 * 60 * 60
+    etag = response.headers['ETag']
+    assert '3ee570ed6c5a01c8' in etag
+
+    response = client.get(GIF_URL, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    response = client.get(GIF_URL, headers={'Range': 'bytes=0-4'})
+    assert response.status_code == 206
+    assert response.data == b'GIF89'
+
+
+def test_image_stale_digest(client):
+    assert client.get('/1/image-0000000000000000.gif').status_code == 404
+    assert client.get('/2/image-3ee570ed6c5a01c8.gif').status_code == 404
+
+
+def test_legacy_image_url(client, app):
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "UPDATE post_image SET digest = NULL, variants = 'thumb display'"
+        )
+        db.commit()
+    assert b'src="/1/image.gif?size=display"' in client.get('/1').data
+
+    response = client.get('/1/image.gif?size=display')
+    assert response.status_code == 302
+    assert response.location.endswith(GIF_URL + '?size=display')
+    assert b'src="/1/image-3ee570ed6c5a01c8.gif' in client.get('/1').data
+    assert client.get('/2/image.gif').status_code == 404
+
+
+def test_image_accel_redirect(client, app, image_file):
+    app.config['IMAGE_ACCEL_REDIRECT'] = '/internal/images/'
+    response = client.get(GIF_URL)
+    location = image_file('1.gif').relative_to(
+        app.config['POST_IMAGE_FOLDER']
+    )
+    assert response.headers['X-Accel-Redirect'] == \
+        f'/internal/images/{location}'
+    assert response.mimetype == 'image/gif'
+    assert response.data == b''
+    assert response.cache_control.immutable
+
+    etag = response.headers['ETag']
+    response = client.get(GIF_URL, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_image_x_sendfile(client, app):
+    app.config['USE_X_SENDFILE'] = True
+    response = client.get(GIF_URL)
+    assert response.headers['X-Sendfile'].endswith('1.gif')
+    assert response.cache_control.immutable
+
+
+def test_shard_images_command(runner, app, image_file):
+    folder = app.config['POST_IMAGE_FOLDER']
+    shutil.move(image_file('1.gif'), Path(folder, '1.gif'))
+    shutil.copy(Path(folder, '1.gif'), Path(folder, '1.thumb.gif'))
+    Path(folder, 'notes.txt').write_text('')
+
+    result = runner.invoke(args=['shard-images'])
+    assert 'Moved 2 files.' in result.output
+    assert image_file('1.gif').exists()
+    assert image_file('1.thumb.gif').exists()
+    assert Path(folder, 'notes.txt').exists()
+    result = runner.invoke(args=['shard-images'])
+    assert 'Moved 0 files.' in result.output
@@ -0,0 +1,71 @@
+import json
+import logging
+
+import pytest
+
+
+@pytest.fixture
+def metrics_app(app):
+    app.config['INSTRUMENTATION'] = True
+    # hooks are added when the app is created
+    from flaskr import metrics
+    metrics.init_app(app)
+    return app
+
+
+def test_disabled(client):
+    assert 'Server-Timing' not in client.get('/1').headers
+    assert client.get('/metrics').status_code == 404
+
+
+def test_server_timing(metrics_app, client, auth, caplog):
+    caplog.set_level(logging.DEBUG, 'flaskr.metrics')
+    timing = client.get('/1').headers['Server-Timing']
+    assert 'db;dur=' in timing
+    assert 'desc="3 queries"' in timing
+    assert 'render;dur=' in timing
+    assert 'total;dur=' in timing
+
+    record, *queries = [
+        json.loads(record.getMessage()) for record in caplog.records
+    ]
+    assert record['endpoint'] == 'blog.read'
+    assert record['queries'] == len(queries) == 3
+    assert record['render_ms'] > 0
+    assert queries[0]['sql'].startswith('SELECT version, modified')
+
+    # statements in a transaction of the connection are timed too
+    auth.login()
+    caplog.clear()
+    client.post('/1/like')
+    assert 'DELETE FROM reaction' in caplog.text
+
+
+def test_metrics(metrics_app, client, auth):
+    client.get('/')
+    client.get('/')
+    client.get('/no/such/page')
+    auth.login()
+    client.post('/create', data={
+        'title': 'created', 'body': '*new*', 'tags': '', 'image': (None, ''),
+    }, content_type='multipart/form-data')
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'flaskr_requests_total{endpoint="blog.index",method="GET",' \
+        'status="200"} 2' in text
+    assert 'endpoint="unmatched",method="GET",status="404"} 1' in text
+    assert 'flaskr_request_duration_seconds_bucket{endpoint="blog.index",' \
+        'le="+Inf"} 2' in text
+    assert 'flaskr_request_duration_seconds_count{endpoint="blog.index"} 2' \
+        in text
+    assert 'flaskr_markdown_seconds_total{endpoint="blog.create"}' in text
+    assert 'flaskr_page_cache' not in text
+
+
+def test_metrics_cache_stats(metrics_app, client):
+    metrics_app.config['PAGE_CACHE'] = 'memory'
+    client.get('/1')
+    client.get('/1')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'flaskr_page_cache_requests_total{result="hit"} 1' in text
+    assert 'flaskr_page_cache_requests_total{result="miss"} 1' in text
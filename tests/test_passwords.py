@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+from flaskr.db import get_db
+from flaskr.passwords import HashPool, RateLimiter, needs_rehash
+from werkzeug.exceptions import ServiceUnavailable
+
+
+def get_hash(app):
+    with app.app_context():
+        return get_db().execute(
+            'SELECT password FROM "user" WHERE id = 1'
+        ).fetchone()[0]
+
+
+def test_rehash_on_login(client, auth, app):
+    assert get_hash(app).startswith('pbkdf2:sha256:50000$')
+    auth.login()
+    assert get_hash(app).startswith('pbkdf2:sha256:1000$')
+    auth.logout()
+    assert auth.login().headers['Location'] == '/'
+
+
+def test_rehash_with_default_parameters(client, auth, app):
+    # werkzeug writes hashes of this method as pbkdf2:sha256:<iterations>
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256'
+    auth.login()
+    pwhash = get_hash(app)
+    with app.app_context():
+        assert not needs_rehash(pwhash)
+    auth.logout()
+    auth.login()
+    # a new hash would have a new salt
+    assert get_hash(app) == pwhash
+
+
+def test_login_rate_limit(client, auth, app):
+    app.config['LOGIN_RATE_LIMIT'] = (3, 60)
+    for _ in range(3):
+        assert auth.login('test', 'wrong').status_code == 200
+    response = auth.login()
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) == 20
+    # another username from the same address is limited too
+    assert auth.login('other', 'other').status_code == 429
+
+
+def test_rate_limiter_refills(monkeypatch):
+    now = [0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+    limiter = RateLimiter(2, 10, max_keys=2)
+    assert limiter.hit('a') == limiter.hit('a') == 0
+    assert limiter.hit('a') == 5
+    now[0] = 5
+    assert limiter.hit('a') == 0
+    now[0] = 100
+    limiter.hit('b')
+    limiter.hit('c')
+    assert set(limiter._buckets) == {'b', 'c'}
+
+
+def test_rate_limiter_max_keys(monkeypatch):
+    now = [0]
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+    limiter = RateLimiter(2, 10, max_keys=4)
+    # none of these buckets fills up again before the next key comes
+    for i in range(100):
+        now[0] = i / 100
+        limiter.hit(f'user:{i}')
+        assert len(limiter._buckets) <= 4
+    assert 'user:99' in limiter._buckets
+    assert 'user:0' not in limiter._buckets
+
+
+def test_hash_pool_busy():
+    pool = HashPool(workers=1, timeout=0)
+    release = threading.Event()
+    threads = [
+        threading.Thread(target=pool.run, args=(release.wait,))
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    while pool._slots._value:
+        time.sleep(0.001)
+    with pytest.raises(ServiceUnavailable):
+        pool.run(len, 'busy')
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert pool.run(len, 'free') == 4
@@ -0,0 +1,48 @@
+import subprocess
+import sys
+import threading
+
+from flaskr import create_app
+from flaskr.rendering import markdown
+
+
+def test_markdown():
+    assert markdown('*a*') == '<p><em>a</em></p>'
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(markdown('# b')))
+    thread.start()
+    thread.join()
+    assert results == ['<h1>b</h1>']
+
+
+def test_lazy_imports(tmp_path):
+    # a new worker doesn't load the modules only some requests need
+    modules = subprocess.run([sys.executable, '-c', f"""
+import sys
+from flaskr import create_app
+create_app({{
+    'DATABASE': {str(tmp_path / 'db')!r},
+    'POST_IMAGE_FOLDER': {str(tmp_path / 'images')!r},
+}})
+print(' '.join(sys.modules))
+"""], check=True, capture_output=True, text=True).stdout.split()
+    for module in ('markdown', 'PIL', 'psycopg'):
+        assert module not in modules
+
+
+def test_compile_templates(app, tmp_path):
+    result = app.test_cli_runner().invoke(args=['compile-templates'])
+    assert 'TEMPLATE_CACHE_DIR is not set' in result.output
+
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': app.config['DATABASE'],
+        'TEMPLATE_CACHE_DIR': str(tmp_path),
+    })
+    result = app.test_cli_runner().invoke(args=['compile-templates'])
+    assert 'Compiled ' in result.output
+    assert len(list(tmp_path.glob('*.cache'))) == len(
+        app.jinja_env.list_templates()
+    )
+    assert app.test_client().get('/1').status_code == 200
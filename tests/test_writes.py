@@ -0,0 +1,81 @@
+import pytest
+from flaskr.db import get_db
+from flaskr.writes import get_write_queue
+
+
+@pytest.fixture
+def write_queue(app):
+    app.config['WRITE_QUEUE'] = True
+    # long enough for all the changes of a test to land in one batch
+    app.config['WRITE_BATCH_DELAY'] = 0.2
+    with app.app_context():
+        write_queue = get_write_queue()
+    yield write_queue
+    write_queue.close()
+
+
+def get_counts(app, id):
+    with app.app_context():
+        return tuple(get_db().execute(
+            'SELECT like_count, comment_count FROM post WHERE id = ?', (id,)
+        ).fetchone())
+
+
+def test_read_your_writes(write_queue, client, auth, app):
+    auth.login()
+    client.post('/2/like')
+    client.post('/2/comment', data={'body': 'queued'})
+    # the page waits for the changes of its user to be committed
+    response = client.get('/2')
+    assert '🤍&nbsp;0' in response.data.decode('utf-8')
+    assert b'queued' in response.data
+    assert get_counts(app, 2) == (0, 1)
+
+
+def test_batch_coalesces_reactions(write_queue, app):
+    # user 1 likes post 2 already
+    for liked in (True, False, True):
+        write_queue.put(1, 'react', 2, liked)
+    write_queue.put(2, 'react', 2, True)
+    write_queue.put(1, 'comment', 'one', 1, 2)
+    write_queue.put(1, 'comment', 'two', 1, 2)
+    write_queue.put(1, 'comment', 'lost', 1, 99)
+    write_queue.flush()
+
+    assert get_counts(app, 2) == (2, 2)
+    assert write_queue.wait(1, timeout=0)
+
+
+def test_failed_batch_released(write_queue, app, monkeypatch):
+    monkeypatch.setattr(
+        'flaskr.writes.apply_writes',
+        lambda batch: get_db().execute('INSERT INTO missing VALUES (1)')
+    )
+    write_queue.put(1, 'react', 2, False)
+    write_queue.flush()
+    assert write_queue.wait(1, timeout=0)
+    assert get_counts(app, 2) == (1, 0)
+
+
+def test_queue_survives_errors(write_queue, app, monkeypatch):
+    def invalidate(*tags):
+        raise OSError('page cache folder is gone')
+
+    monkeypatch.setattr('flaskr.writes.invalidate', invalidate)
+    # wait() rather than flush(), which would hang if the thread died
+    write_queue.put(1, 'react', 2, False)
+    assert write_queue.wait(1, timeout=5)
+    assert get_counts(app, 2) == (0, 0)
+
+    monkeypatch.undo()
+    write_queue.put(1, 'comment', 'later', 1, 2)
+    assert write_queue.wait(1, timeout=5)
+    assert get_counts(app, 2) == (0, 1)
+
+
+def test_queue_disabled(app, client, auth):
+    auth.login()
+    client.post('/2/like')
+    assert 'write_queue' in app.extensions
+    assert app.extensions['write_queue'] is None
+    assert get_counts(app, 2) == (0, 0)